@@ -0,0 +1,349 @@
+import functools
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import cube
+import intervals
+import profiling
+
+####################################################################################################
+###############################    CACHED, SESSION-SHARED AGGREGATES    ############################
+####################################################################################################
+''' Streamlit reruns main.py on every widget interaction, but most tables in the app don't depend on the widgets.
+Every function below takes the full cleaned dataset (plus any widget values) and its result is kept in a module
+level store, keyed on dino.attrs["version"] (the source hash set by dataset.load()). The module is imported once
+per process, so a result is computed once and then shared by all sessions. When the version changes the store is
+dropped. A frame filtered by the time slider (time_window()) also carries its window in dino.attrs["window"], which
+is part of the key. Results of a window are whole-frame derivatives (indexes, cubes, string copies), so only the
+MAX_WINDOWS most recently used windows keep theirs; beyond that the store keeps the MAX_ENTRIES most recently used.
+The returned DataFrames are shared, so callers must not modify them.
+st.cache_data would hash the whole DataFrame and unpickle a copy of the result on every call, which is the pandas
+work this module is meant to avoid.'''
+
+MAX_ENTRIES = 5000
+MAX_WINDOWS = 4  # About 12MB of results per window of 200k rows, so ~250MB for windows of 1M rows
+
+store = OrderedDict()  # {(function, version, window, *args): result}, least recently used first
+windows = OrderedDict()  # {window: None} of the results in the store, least recently used first
+stats = Counter()  # {"hits": n, "misses": n, "<function>.hits": n, ...}
+lock = threading.Lock()
+
+
+def invalidate(version=None):
+    ''' Drops cached results of one dataset version, or all of them '''
+    with lock:
+        for key in [key for key in store if version is None or key[1] == version]:
+            del store[key]
+
+
+def cache_key(name, dino, *args):
+    ''' (name, dataset version, time window or None, *args), shared by the figure and export caches '''
+    return (name, dino.attrs["version"], dino.attrs.get("window"), *args)
+
+
+def remember(entries, key, value, max_entries=None, max_bytes=None):
+    ''' Adds `value` to the LRU dict `entries` keyed by cache_key() (the caller holds its lock). Entries of another
+    dataset version are dropped first, then the least recently used ones over max_entries, or over max_bytes (len()
+    of the values). Used by this store, the figure specs and the export files, so all three follow rekey() '''
+    if entries and next(iter(entries))[1] != key[1]:  # Dataset artifact changed, old entries are stale (they all share one version)
+        entries.clear()
+    entries[key] = value
+    size = sum(map(len, entries.values())) if max_bytes else 0
+    while len(entries) > 1 and (max_entries and len(entries) > max_entries or max_bytes and size > max_bytes):
+        _, dropped = entries.popitem(last=False)
+        size -= len(dropped) if max_bytes else 0
+
+
+def window_of(key):
+    ''' The time window a result belongs to: the one of its frame, or the one window_rows() selects '''
+    return tuple(key[3:]) if key[0] == "window_rows" else key[2]
+
+
+def use_window(window):
+    ''' Marks a time window as used, dropping the results of the least recently used ones over MAX_WINDOWS (the
+    caller holds the lock) '''
+    if window is None:
+        return
+    windows[window] = None
+    windows.move_to_end(window)
+    while len(windows) > MAX_WINDOWS:
+        oldest, _ = windows.popitem(last=False)
+        for key in [key for key in store if window_of(key) == oldest]:
+            del store[key]
+
+
+def cached(func):
+    @functools.wraps(func)
+    def wrapper(dino, *args):
+        key = cache_key(func.__name__, dino, *args)
+        with lock:
+            use_window(window_of(key))
+            if key in store:
+                store.move_to_end(key)
+                stats["hits"] += 1
+                stats[f"{func.__name__}.hits"] += 1
+                return store[key]
+        with profiling.timed("pandas", len(dino)):
+            result = func(dino, *args)
+        with lock:
+            use_window(window_of(key))  # Again, another session may have dropped the window in the meantime
+            remember(store, key, result, max_entries=MAX_ENTRIES)
+            stats["misses"] += 1
+            stats[f"{func.__name__}.misses"] += 1
+        return result
+    return wrapper
+
+
+def counters():
+    ''' Copy of stats, {"hits": n, "misses": n, "<function>.hits": n, ...} '''
+    with lock:
+        return dict(stats)
+
+
+def report():
+    ''' Cache hits and misses in total and per function (shown in profiling.debug_panel()) '''
+    return ", ".join(f"{key}: {value}" for key, value in sorted(counters().items()))
+
+
+''' SCOPES: the results that only depend on the species with one value of a dimension, {function: (dimension, position
+of that value among its arguments)}. After an incremental refresh (refresh.py) they are kept for the new dataset
+version unless a changed species had that value (a period argument like "Jurassic" covers all its epochs). Every
+other result is dropped, it depends on all rows or on their positions.'''
+
+SCOPES = {"locations": ("period", 0), "group_locations": ("major_group", 0)}
+
+
+def affected(key, scopes, changed):
+    ''' Whether the cached result of `key` may differ after a refresh that changed species with the `changed`
+    {dimension: labels}, old and new ones '''
+    dimension, position = scopes.get(key[0], (None, None))
+    value = key[3 + position] if dimension and len(key) > 3 + position else None  # None: all species
+    if value is None:
+        return True
+    return any(value == label or (dimension == "period" and value in label) for label in changed[dimension])
+
+
+def rekey(entries, scopes, old_version, new_version, changed):
+    ''' Moves the entries of old_version that no changed species affects to new_version (keeping their LRU order)
+    and drops all others. Returns the number kept '''
+    for key in list(entries):
+        value = entries.pop(key)
+        if key[1] == old_version and not affected(key, scopes, changed):
+            entries[(key[0], new_version, *key[2:])] = value
+    return len(entries)
+
+
+def refreshed(old_version, new_version, changed):
+    with lock:
+        return rekey(store, SCOPES, old_version, new_version, changed)
+
+
+''' SUBSETS are cached as row positions, not as DataFrames: the store keeps 8 bytes per selected row instead of a copy
+of the columns, and the *_rows() functions combine cheaply. The matching functions without _rows build the
+DataFrame from them for one caller, so it is freed once the caller is done with it.'''
+
+
+def mask_rows(mask):
+    return np.flatnonzero(np.asarray(mask, dtype=bool))
+
+
+@cached
+def non_0_rows(dino):
+    return mask_rows(dino["length"] != 0)  # There are 0 values in the 'length' column, when calculating sizes I will use these rows instead of the whole frame
+
+
+def non_0_size(dino):
+    return dino.iloc[non_0_rows(dino)]
+
+
+@cached
+def clade_rows(dino, clade, sized=False):
+    ''' Species with `clade` among their taxonomy ranks (only those with a known length if `sized`) '''
+    rows = mask_rows(dino["taxonomy"].str.contains(clade))
+    return np.intersect1d(rows, non_0_rows(dino)) if sized else rows
+
+
+@cached
+def kp_rows(dino):
+    return mask_rows((dino["period_to"] < 67).fillna(False))
+
+
+def kp_species(dino):
+    return dino.iloc[kp_rows(dino)]
+
+
+@cached
+def size_rows(dino, size):
+    rows = non_0_rows(dino)
+    return rows[dino["length"].iloc[rows].between(size, size + 0.99).to_numpy()]
+
+
+def species_by_size(dino, size):
+    return dino.iloc[size_rows(dino, size)]
+
+
+def bin_index(values, bins):
+    low, high = values.min(), values.max()
+    if not high > low:
+        return np.zeros(len(values), dtype=int)
+    return np.minimum(((values - low) / (high - low) * bins).astype(int), bins - 1)
+
+
+@cached
+def binned_sizes(dino, bins=(120, 60)):
+    ''' Non-zero sizes aggregated on a grid of bins[0] x bins[1] cells over (period_to, length), one row per non-empty
+    cell: mean position, number of species, most common major group and the first three species names '''
+    sizes = non_0_size(dino)
+    x, y = sizes["period_to"].to_numpy(dtype=float), sizes["length"].to_numpy(dtype=float)
+    cells = pd.DataFrame({"cell": bin_index(x, bins[0]) * bins[1] + bin_index(y, bins[1]), "period_to": x, "length": y, "major_group": sizes["major_group"].to_numpy(), "name": sizes["name"].to_numpy()})
+    binned = cells.groupby("cell").agg(period_to=("period_to", "mean"), length=("length", "mean"), species=("name", "size"))
+    groups = cells.groupby(["cell", "major_group"], observed=True).size().sort_values(ascending=False, kind="stable").reset_index()
+    binned["major_group"] = groups.drop_duplicates("cell").set_index("cell")["major_group"].astype(str)
+    binned["names"] = cells.groupby("cell").head(3).groupby("cell")["name"].agg(", ".join)
+    return binned.reset_index(drop=True)
+
+
+@cached
+def names(dino):
+    return dino["name"].unique()
+
+
+@cached
+def group_names(dino):
+    return dino["major_group"].unique()
+
+
+@cached
+def sunburst_paths(dino, path):
+    return dino[list(path)].astype(str)  # Plain strings, so the sunburst skips empty category combinations
+
+
+@cached
+def location_cube(dino):
+    return cube.from_dataset(dino)
+
+
+@cached
+def locations(dino, period=None):
+    ''' Species per country (lived_in, iso3, species), in one geological period or all of them '''
+    return location_cube(dino).by_country(period=period)
+
+
+@cached
+def group_locations(dino, group):
+    group_diversity = location_cube(dino).by_country(major_group=group)
+    group_diversity["species"] = group_diversity["species"].astype(str)
+    return group_diversity
+
+
+@cached
+def group_counts(dino):
+    groups = dino["major_group"].value_counts()
+    groups = groups[groups > 0].reset_index()  # A time window keeps every category, only list the groups it has
+    return groups.rename(columns={"index": "Group", "major_group": "Species"})
+
+
+@cached
+def major_group_ranges(dino):
+    ranges = dino.groupby("major_group", observed=True).agg({"period_to": "min", "period_from": "max"}).reset_index()
+    ranges["delta"] = ranges["period_to"] - ranges["period_from"]
+    return ranges
+
+
+@cached
+def sizes_in_groups(dino):
+    ''' (largest, average, smallest) length in each major group '''
+    families_grouped = non_0_size(dino).groupby("major_group", observed=True)
+    return families_grouped["length"].max().reset_index(), families_grouped["length"].mean().reset_index(), families_grouped["length"].min().reset_index()
+
+
+@cached
+def discoverers(dino):
+    names = dino["named_by"].value_counts().reset_index()
+    return names.rename(columns={"index": "Name", "named_by": "Species discovered"})
+
+
+@cached
+def diversity(dino):
+    dino_diversity = dino["period_to"].value_counts().astype(int).reset_index()  # counts of a nullable column are nullable too, plotly needs plain ints
+    return dino_diversity.rename(columns={"period_to": "Fossils age", "count": "Number of species"})
+
+
+@cached
+def discoveries(dino):
+    dino_discoveries = dino["discovered"].value_counts().reset_index()
+    return dino_discoveries.rename(columns={"discovered": "Year", "count": "Species"})
+
+
+@cached
+def time_index(dino):
+    return intervals.from_periods(dino)
+
+
+@cached
+def time_range(dino):
+    ''' (youngest, oldest) end of all species ranges, in whole mln years '''
+    index = time_index(dino)
+    return int(np.floor(index.low.min())), int(np.ceil(index.high.max()))
+
+
+@cached
+def window_rows(dino, start, end):
+    ''' Species alive at any time between `start` and `end` mln years ago, found in the interval index '''
+    return time_index(dino).overlapping(start, end)
+
+
+def time_window(dino, start, end):
+    window = dino.iloc[window_rows(dino, start, end)]
+    window.attrs = {**dino.attrs, "window": (start, end)}  # New dict, the full frame keeps its attrs
+    return window
+
+
+@cached
+def lifeline(dino):
+    ''' Number of species alive in every mln years of the time window (0 - 249 for the full dataset), oldest first '''
+    start, end = dino.attrs.get("window") or (0, 249)
+    years = np.arange(end, start - 1, -1)
+    return pd.DataFrame({"years": years, "species": time_index(dino).count_alive(years)})
+
+
+@cached
+def summary(dino):
+    ''' (millions of years covered, number of groups, number of countries, list of countries) '''
+    countries = dino["lived_in"].unique()
+    return dino["period_from"].max() - dino["period_to"].min(), dino["major_group"].nunique(), len(countries), ", ".join(countries)
+
+
+@cached
+def oldest_fossils(dino):
+    oldest_fossil = dino["period_from"].max()
+    return oldest_fossil, dino[dino["period_from"] == oldest_fossil]  # dino.iloc[dino["period_from"].idxmax()] returns only one entry
+
+
+@cached
+def size_records(dino):
+    ''' {label: (length, species with that length)} for the records in the Size section '''
+    sizes = non_0_size(dino)
+    theropods = dino.iloc[clade_rows(dino, "Theropoda")]
+    dromaeosaurs = dino.iloc[clade_rows(dino, "Paraves")]
+    records = {"average": (sizes["length"].mean(), None)}
+    for label, selection, length in (("largest", dino, sizes["length"].max()), ("smallest", dino, sizes["length"].min()),
+                                     ("largest_theropod", theropods, theropods["length"].max()), ("largest_dromaeosaur", dromaeosaurs, dromaeosaurs["length"].max())):
+        records[label] = (length, selection[selection["length"] == length])
+    return records
+
+
+@cached
+def sauropod_sizes(dino):
+    ''' (fossil age, average size) of sauropods for each period_to '''
+    sauropods = dino.iloc[clade_rows(dino, "Sauropodomorpha", True)].groupby("period_to")
+    return pd.DataFrame({"age": sauropods["period_to"].max().to_numpy(), "size": sauropods["length"].mean().to_numpy()})  # A frame, so a time window without sauropods is an empty chart
+
+
+@cached
+def largest_theropods(dino):
+    sizes = non_0_size(dino)
+    return sizes[sizes["type"] == "large theropod"].sort_values("length")[-10:]
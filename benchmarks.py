@@ -0,0 +1,274 @@
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import dataset
+import exports
+import figures
+import indexes
+import search
+import synthetic
+
+####################################################################################################
+######################################    BENCHMARK SUITE    #######################################
+####################################################################################################
+''' End to end timings on synthetic datasets from 300 rows (the size of dino_updated.csv) to 10M rows:
+every stage of dataset.clean(), every aggregation and figure main.py builds with its default widget values, and
+whole headless runs of main.py, first with empty caches and then again with the caches of the first run.
+Aggregations and figures are timed cold (their caches emptied before every repeat) and the best of REPEAT runs is
+kept. Sizes above IN_MEMORY_ROWS don't fit in memory as one frame here, so only the cleaning is measured for them,
+chunk by chunk like pipeline.py does.
+Results are written as JSON, {"meta": {...}, "timings": {"<rows>/<group>/<name>": seconds}}, and compared with a
+baseline file: python benchmarks.py --sizes 300 10000 --output new.json --baseline old.json exits with 1 when any
+timing got more than TOLERANCE slower (and by more than MIN_SECONDS, below that it is noise).'''
+
+SIZES = (300, 10_000, 100_000, 1_000_000)
+IN_MEMORY_ROWS = 1_000_000
+REPEAT = 3
+TOLERANCE = 0.25
+MIN_SECONDS = 0.005
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def best_of(func, repeat=REPEAT, setup=None):
+    ''' Lowest wall time of `repeat` calls of func(), setup() runs untimed before each one '''
+    best = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def dataset_of(rows, seed=0):
+    ''' Cleaned synthetic dataset, the real one for 300 rows. Returns (dino, {stage: seconds}) '''
+    timings = {}
+    if rows == 300:
+        raw = dataset.read_source()
+    else:
+        raw = synthetic.generate(rows, seed)
+    dino = dataset.clean(raw, [], timings)
+    dino.attrs["version"] = f"benchmark-{rows}-{seed}"
+    return dino, timings
+
+
+def clean_streamed(rows, seed=0, chunk_rows=synthetic.CHUNK_ROWS):
+    ''' {stage: seconds} of cleaning `rows` synthetic rows one chunk at a time (bounded memory, for 10M rows) '''
+    source, timings = synthetic.real_rows(), {}
+    for start in range(0, rows, chunk_rows):
+        dataset.clean(synthetic.generate(min(chunk_rows, rows - start), seed, start, source), [], timings)
+    return timings
+
+
+def aggregations(dino):
+    ''' {name: call} of the aggregations main.py runs, with the default widget values '''
+    group = aggregates.group_names(dino)[0]
+    return {
+        "names": lambda: aggregates.names(dino),
+        "indexes": lambda: indexes.get(dino),
+        "search_index": lambda: search.search_index(dino),
+        "search page": lambda: search.page(dino, "", 0),
+        "time_range": lambda: aggregates.time_range(dino),
+        "time_window": lambda: aggregates.time_window(dino, 100, 150),
+        "summary": lambda: aggregates.summary(dino),
+        "oldest_fossils": lambda: aggregates.oldest_fossils(dino),
+        "kp_species": lambda: aggregates.kp_species(dino),
+        "non_0_rows": lambda: aggregates.non_0_rows(dino),
+        "location_cube": lambda: aggregates.location_cube(dino),
+        "group_counts": lambda: aggregates.group_counts(dino),
+        "group_names": lambda: aggregates.group_names(dino),
+        "group_size_records": lambda: indexes.get(dino).size_records(group),
+        "size_records": lambda: aggregates.size_records(dino),
+        "species_by_size": lambda: aggregates.species_by_size(dino, 10),
+        "discoverers": lambda: aggregates.discoverers(dino),
+        "export CSV": lambda: exports.download(dino, "CSV"),
+    }
+
+
+def figure_builds(dino):
+    ''' {name: call} of the figures main.py shows, with the default widget values '''
+    group = aggregates.group_names(dino)[0]
+    builds = {
+        "size_comparison": lambda: figures.size_comparison(dino, 3),
+        "all_dinosaurs": lambda: figures.all_dinosaurs(dino, "name"),
+        "groups_sunburst": lambda: figures.groups_sunburst(dino, False),
+        "major_groups_timeline": lambda: figures.major_groups_timeline(dino),
+        "group_map": lambda: figures.group_map(dino, group, False),
+        "sizes_in_groups": lambda: figures.sizes_in_groups(dino),
+        "sauropod_sizes": lambda: figures.sauropod_sizes(dino),
+        "trex": lambda: figures.trex(dino),
+        "diversity": lambda: figures.diversity(dino),
+        "discoveries": lambda: figures.discoveries(dino),
+        "lifeline": lambda: figures.lifeline(dino),
+    }
+    for period in (None, "Triassic", "Jurassic", "Cretaceous"):
+        builds[f"location_heatmap {period or 'all'}"] = lambda period=period: figures.location_heatmap(dino, period, str(period))
+        builds[f"location_scatter {period or 'all'}"] = lambda period=period: figures.location_scatter(dino, period, str(period))
+    return builds
+
+
+def empty_caches():
+    aggregates.invalidate()
+    figures.invalidate()
+    with exports.lock:
+        exports.files.clear()
+
+
+def run_script(timeout=600):
+    ''' One headless run of main.py in this process, on whatever dataset.get() returns. Returns the exceptions shown.
+    Uses AppTest where Streamlit has it (1.28+), otherwise the LocalScriptRunner setup of Streamlit's own tests. '''
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        AppTest = None
+    if AppTest is not None:
+        app = AppTest.from_file(SCRIPT, default_timeout=timeout)
+        app.run()
+        return [exception.message for exception in app.exception]
+
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner import RerunData
+    from streamlit.testing.local_script_runner import LocalScriptRunner, require_widgets_deltas
+
+    config.set_option("runner.postScriptGC", False)
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    try:
+        runner = LocalScriptRunner(SCRIPT)
+        runner.request_rerun(RerunData())
+        runner.start()
+        require_widgets_deltas(runner, timeout)  # Not runner.run(), its element tree can't parse every block of 1.23
+        runner.join()
+        messages = [message.delta.new_element for message in runner.forward_msgs() if message.HasField("delta")]
+        return [element.exception.message for element in messages if element.WhichOneof("type") == "exception"]
+    finally:
+        Runtime._instance = None
+
+
+def script_runs(dino):
+    ''' Seconds of a first run of main.py (empty caches) and of a rerun (the caches of the first run) '''
+    import logging
+
+    loaded = dataset.loaded
+    dataset.loaded = dino  # main.py gets it from dataset.get()
+    empty_caches()
+    logging.disable(logging.WARNING)  # Streamlit warns about the missing runtime and Arrow conversions on every run
+    try:
+        timings = {}
+        for label in ("first run", "rerun"):
+            start = time.perf_counter()
+            errors = run_script()
+            timings[label] = time.perf_counter() - start
+            if errors:
+                raise RuntimeError(f"main.py failed on {len(dino)} rows: {errors}")
+        return timings
+    finally:
+        logging.disable(logging.NOTSET)
+        dataset.loaded = loaded
+
+
+def run(sizes=SIZES, repeat=REPEAT, seed=0, app=True):
+    ''' All timings of all sizes, {"<rows>/<group>/<name>": seconds} '''
+    timings = {}
+    for rows in sizes:
+        start = time.perf_counter()
+        if rows > IN_MEMORY_ROWS:
+            for stage, seconds in clean_streamed(rows, seed).items():
+                timings[f"{rows}/clean/{stage}"] = seconds
+            print(f"{rows:>9} rows: cleaning only (above IN_MEMORY_ROWS), {time.perf_counter() - start:.1f}s")
+            continue
+        dino, stages = dataset_of(rows, seed)
+        for stage, seconds in stages.items():
+            timings[f"{rows}/clean/{stage}"] = seconds
+        for name, call in aggregations(dino).items():
+            timings[f"{rows}/aggregate/{name}"] = best_of(call, repeat, empty_caches)
+        for call in aggregations(dino).values():  # Figures are timed on warm aggregates
+            call()
+        for name, call in figure_builds(dino).items():
+            timings[f"{rows}/figure/{name}"] = best_of(call, repeat, figures.invalidate)
+        if app:
+            for label, seconds in script_runs(dino).items():
+                timings[f"{rows}/app/{label}"] = seconds
+        empty_caches()
+        print(f"{rows:>9} rows: {time.perf_counter() - start:.1f}s")
+    return timings
+
+
+def meta(sizes, repeat, seed):
+    import plotly
+    import streamlit
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "sizes": list(sizes), "repeat": repeat, "seed": seed,
+        "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__, "plotly": plotly.__version__,
+        "streamlit": streamlit.__version__, "machine": platform.machine(), "cpus": os.cpu_count(),
+        "formats": {"real": synthetic.formats(synthetic.real_rows()), "synthetic": synthetic.formats(synthetic.generate(min(max(sizes), 100_000), seed))},
+    }
+
+
+def save(results, path):
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1, default=float)
+    os.replace(f"{path}.tmp", path)
+
+
+def compare(timings, baseline, tolerance=TOLERANCE, min_seconds=MIN_SECONDS):
+    ''' [(key, baseline seconds, seconds)] of the timings more than `tolerance` slower than in the baseline '''
+    slower = []
+    for key, seconds in timings.items():
+        before = baseline.get(key)
+        if before is not None and seconds > before * (1 + tolerance) and seconds - before > min_seconds:
+            slower.append((key, before, seconds))
+    return slower
+
+
+def table(timings, baseline=None):
+    lines = [f"{'timing':48} {'seconds':>10}" + (f" {'baseline':>10} {'change':>8}" if baseline else "")]
+    for key, seconds in timings.items():
+        line = f"{key:48} {seconds:10.4f}"
+        if baseline and key in baseline:
+            line += f" {baseline[key]:10.4f} {(seconds / baseline[key] - 1) * 100 if baseline[key] else 0:+7.0f}%"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark cleaning, aggregations, figures and main.py reruns on synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help=f"rows, up to 10M (only cleaning above {IN_MEMORY_ROWS})")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-app", action="store_true", help="skip the headless runs of main.py")
+    parser.add_argument("--output", default="./benchmarks.json")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    results = {"meta": meta(args.sizes, args.repeat, args.seed), "timings": run(args.sizes, args.repeat, args.seed, not args.no_app)}
+    save(results, args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["timings"]
+    print(table(results["timings"], baseline))
+    print(f"results written to {args.output}")
+    if baseline:
+        slower = compare(results["timings"], baseline, args.tolerance)
+        for key, before, seconds in slower:
+            print(f"REGRESSION {key}: {before:.4f}s -> {seconds:.4f}s")
+        sys.exit(1 if slower else 0)
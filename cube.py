@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+####################################################################################################
+###################################    SPECIES COUNT CUBE    #######################################
+####################################################################################################
+''' The maps used to group a filtered copy of the frame by lived_in and .count() all 15 columns for every period and
+group, after a str.contains scan of the periods. The cube counts the species once per dataset version for every
+combination of (lived_in, period, major_group, diet) in a dense array, so the counts of any map or filter are a
+sum over a few thousand cells, whatever the number of rows. Its size is the product of the category counts,
+e.g. 31 x 6 x 24 x 5 for dino_updated.csv. Countries are resolved to ISO-3 codes from COUNTRIES_CSV when the cube
+is built, so the maps use locationmode="ISO-3" instead of plotly matching country names in the browser.
+Names without a code (like "North Africa") are left out of the maps, plotly couldn't place them either. Names with
+the same code (England, Wales and United Kingdom) are one location, their counts are summed and named together.'''
+
+COUNTRIES_CSV = "./countries.csv"
+DIMENSIONS = ("lived_in", "period", "major_group", "diet")
+PERIODS = ("Triassic", "Jurassic", "Cretaceous")
+
+
+def read_countries(path=COUNTRIES_CSV):
+    countries = pd.read_csv(path, keep_default_na=False)
+    return dict(zip(countries["name"], countries["iso3"]))
+
+
+class Cube:
+    def __init__(self, dino, countries):
+        ''' Every dimension is a categorical column, its codes index the cube. Missing values (code -1) get an extra
+        last slot, so they still count when the dimension isn't filtered on. '''
+        self.labels = {dimension: list(dino[dimension].cat.categories) for dimension in DIMENSIONS}
+        shape = tuple(len(labels) + 1 for labels in self.labels.values())
+        codes = [dino[dimension].cat.codes.to_numpy().astype(np.intp) for dimension in DIMENSIONS]
+        codes = [np.where(code < 0, size - 1, code) for code, size in zip(codes, shape)]
+        cells = np.ravel_multi_index(codes, shape) if len(dino) else np.empty(0, dtype=np.intp)
+        self.counts = np.bincount(cells, minlength=int(np.prod(shape))).reshape(shape)
+        self.positions = {dimension: {label: i for i, label in enumerate(labels)} for dimension, labels in self.labels.items()}
+        self.period_slots = {period: [i for i, label in enumerate(self.labels["period"]) if period in label] for period in PERIODS}
+        self.iso3 = [countries.get(country) for country in self.labels["lived_in"]]
+        self.codes = list(dict.fromkeys(code for code in self.iso3 if code))  # Distinct ISO-3 codes, in label order
+        position = {code: i for i, code in enumerate(self.codes)}
+        self.code_slots = np.array([position.get(code, -1) for code in self.iso3], dtype=np.intp)  # Of every lived_in label, -1 without a code
+
+    def slots(self, dimension, value):
+        ''' Slots of `value` along the dimension, a geological period covers all its epochs '''
+        if dimension == "period" and value in self.period_slots:
+            return self.period_slots[value]
+        position = self.positions[dimension].get(value)
+        return [] if position is None else [position]
+
+    def count(self, **filters):
+        ''' Species per country slot with the given filters, e.g. count(period="Jurassic", major_group="Stegosauria") '''
+        counts = self.counts
+        for axis, dimension in enumerate(DIMENSIONS[1:], start=1):
+            if filters.get(dimension) is not None:
+                counts = counts.take(self.slots(dimension, filters[dimension]), axis=axis)
+        return counts.sum(axis=(1, 2, 3))
+
+    def by_country(self, **filters):
+        ''' DataFrame of lived_in, iso3 and species for the countries with species and an ISO-3 code, one row per code
+        (lived_in joins the names that have species) '''
+        counts = self.count(**filters)[:-1]  # The last slot holds the species without a country
+        present = np.flatnonzero((counts > 0) & (self.code_slots >= 0))
+        species = np.bincount(self.code_slots[present], weights=counts[present], minlength=len(self.codes)).astype(counts.dtype)
+        names = [[] for _ in self.codes]
+        for position in present:
+            names[self.code_slots[position]].append(self.labels["lived_in"][position])
+        countries = pd.DataFrame({"lived_in": [", ".join(labels) for labels in names], "iso3": self.codes, "species": species})
+        return countries[countries["species"] > 0].reset_index(drop=True)
+
+
+def from_dataset(dino, countries=None):
+    return Cube(dino, read_countries() if countries is None else countries)
+
+
+def benchmark(sizes=(300, 1_000_000), queries=100):
+    ''' Cube build and slices vs. the old filter, groupby and count per map '''
+    import time
+
+    import dataset
+    import synthetic
+
+    for size in sizes:
+        dino = dataset.get() if size == 300 else dataset.clean(synthetic.generate(size))
+        groups = list(dino["major_group"].cat.categories)
+        start = time.perf_counter()
+        cube = from_dataset(dino)
+        build = time.perf_counter() - start
+
+        def old(period, group):
+            selection = dino[dino["period"].str.contains(period)] if period else dino
+            selection = selection[selection["major_group"] == group] if group else selection
+            return selection.groupby("lived_in", observed=True).count()["name"]
+
+        filters = [(PERIODS[i % 4] if i % 4 < 3 else None, groups[i % len(groups)] if i % 2 else None) for i in range(queries)]
+        start = time.perf_counter()
+        expected = [old(period, group) for period, group in filters]
+        scan = (time.perf_counter() - start) / queries
+        start = time.perf_counter()
+        found = [cube.by_country(period=period, major_group=group) for period, group in filters]
+        sliced = (time.perf_counter() - start) / queries
+        iso3 = dict(zip(cube.labels["lived_in"], cube.iso3))
+        for counts, countries in zip(expected, found):
+            by_code = counts.groupby(lambda country: iso3.get(country)).sum()  # Countries without a code are dropped
+            assert dict(zip(countries["iso3"], countries["species"])) == {code: count for code, count in by_code.items() if count}
+        print(f"{size:>9} rows  cube {cube.counts.shape} build {build * 1000:7.1f}ms  filter + groupby + count {scan * 1000:8.2f}ms  slice {sliced * 1000:6.2f}ms")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,128 @@
+import gzip
+import io
+import re
+import threading
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import aggregates
+import indexes
+import profiling
+
+####################################################################################################
+##################################    CACHED DATASET DOWNLOADS    ##################################
+####################################################################################################
+''' The download buttons used to run dino.to_csv() and dino.to_html() on every rerun, although they are hardly ever
+clicked. download() serializes a format once per dataset version and keeps the bytes in an LRU bounded by
+MAX_CACHE_BYTES, so a rerun only looks them up. Files are written chunk by chunk (CHUNK_ROWS rows at a time) into
+the output stream, so a large frame is never converted to one big string. A view (selected group or size bucket)
+is exported from its row positions, one chunk at a time, without copying the full frame.
+HTML is the exception: pandas can't append rows to an HTML table, so it is rendered in one go.'''
+
+FORMATS = {  # {label: (file extension, mime type)}
+    "CSV": ("csv", "text/csv"),
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "JSON lines": ("jsonl", "application/x-ndjson"),
+    "HTML": ("html", "text/html"),
+}
+CHUNK_ROWS = 50_000
+MAX_CACHE_BYTES = 128 * 1024 * 1024
+
+files = OrderedDict()  # {(format, version, window, view): bytes}, least recently used first
+lock = threading.Lock()
+
+
+def view_rows(dino, view=None):
+    ''' Row positions of a view: None (all rows), ("group", major group) or ("size", meters) '''
+    if view is None:
+        return None
+    kind, value = view
+    if kind == "group":
+        return indexes.get(dino).group(value)
+    if kind == "size":
+        return aggregates.size_rows(dino, value)
+    raise ValueError(f"Unknown view: {view}")
+
+
+def chunks(dino, rows=None, chunk_rows=CHUNK_ROWS):
+    ''' The selected rows (all by default) as DataFrames of at most chunk_rows rows, always at least one '''
+    count = len(dino) if rows is None else len(rows)
+    for start in range(0, max(count, 1), chunk_rows):
+        yield dino.iloc[start:start + chunk_rows] if rows is None else dino.iloc[rows[start:start + chunk_rows]]
+
+
+def write(dino, fmt, out, rows=None, chunk_rows=CHUNK_ROWS):
+    ''' Streams the selected rows to the binary file object `out` in the format `fmt` (a key of FORMATS) '''
+    if fmt == "Parquet":
+        writer = None
+        for chunk in chunks(dino, rows, chunk_rows):
+            table = pa.Table.from_pandas(chunk, schema=writer and writer.schema, preserve_index=True)  # Every chunk gets the schema of the first
+            writer = writer or pq.ParquetWriter(out, table.schema)
+            writer.write_table(table)
+        writer.close()
+    elif fmt == "CSV (gzip)":
+        with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6, mtime=0) as compressed:  # mtime=0: same bytes for the same data
+            write(dino, "CSV", compressed, rows, chunk_rows)
+    elif fmt == "CSV":
+        for i, chunk in enumerate(chunks(dino, rows, chunk_rows)):
+            out.write(chunk.to_csv(header=i == 0).encode("utf-8"))
+    elif fmt == "JSON lines":
+        for chunk in chunks(dino, rows, chunk_rows):
+            if len(chunk):
+                out.write(chunk.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n").encode("utf-8") + b"\n")
+    elif fmt == "HTML":
+        out.write((dino if rows is None else dino.iloc[rows]).to_html().encode("utf-8"))
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+
+
+def download(dino, fmt, view=None):
+    ''' Returns (bytes, file name, mime type) of the view in the format `fmt`, serialized once per dataset version '''
+    key = aggregates.cache_key(fmt, dino, view)
+    extension, mime = FORMATS[fmt]
+    file_name = "dino_df" + "".join(f"_{re.sub(r'[^a-z0-9]+', '_', str(value).lower())}" for value in view or ()) + f".{extension}"
+    with lock:
+        if key in files:
+            files.move_to_end(key)
+            return files[key], file_name, mime
+    rows = view_rows(dino, view)
+    out = io.BytesIO()
+    with profiling.timed("pandas", len(dino) if rows is None else len(rows)):
+        write(dino, fmt, out, rows)
+    with lock:
+        aggregates.remember(files, key, out.getvalue(), max_bytes=MAX_CACHE_BYTES)
+    return out.getvalue(), file_name, mime
+
+
+def benchmark(sizes=(10_000, 1_000_000)):
+    ''' Time and size of every format for the real dataset repeated to `size` rows, first call and cached call '''
+    import time
+
+    import numpy as np
+
+    import dataset
+
+    for size in sizes:
+        dino = dataset.dino.iloc[np.arange(size) % len(dataset.dino)].reset_index(drop=True)
+        dino.attrs["version"] = f"benchmark-{size}"
+        for fmt in FORMATS:
+            if fmt == "HTML" and size > 100_000:
+                continue
+            start = time.perf_counter()
+            data, _, _ = download(dino, fmt)
+            first = time.perf_counter() - start
+            start = time.perf_counter()
+            download(dino, fmt)
+            cached = time.perf_counter() - start
+            print(f"{size:>9} rows  {fmt:11} {len(data) / 1024 / 1024:8.2f}MB  first {first * 1000:8.1f}ms  cached {cached * 1e6:6.1f}us")
+        start = time.perf_counter()
+        rows = view_rows(dino, ("group", dino["major_group"].iloc[0]))
+        data, _, _ = download(dino, "CSV", ("group", dino["major_group"].iloc[0]))
+        print(f"{size:>9} rows  group view ({len(rows)} rows) CSV {len(data) / 1024:.0f}KB in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,328 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import streamlit as st
+
+import aggregates
+import profiling
+
+px = go = pio = None  # plotly is only imported when a figure has to be built, see import_plotly()
+
+####################################################################################################
+#################################    PREBUILT PLOTLY FIGURE CACHE    ###############################
+####################################################################################################
+''' Building figures with plotly express was most of the server CPU on every rerun. Every function below builds
+one figure from the dataset or its time window (plus widget values) and returns its serialized JSON spec. The spec
+is built once per dataset version and time window and kept in an in-memory LRU (bounded by MAX_CACHE_BYTES), and
+optionally in DISK_CACHE so it survives restarts. plotly_chart() sends a spec to the browser as it is, while
+st.plotly_chart would validate and serialize the figure again on every rerun.'''
+
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+DISK_CACHE = None  # Directory for spec files, e.g. "./figure_cache"
+CHART_CONFIG = json.dumps({"showLink": False, "linkText": False})  # What st.plotly_chart sends by default
+
+specs = OrderedDict()  # {(figure, version, window, *args): spec}, least recently used first
+build_times = {}  # {figure: [builds, total seconds, last spec size]}
+lock = threading.Lock()
+
+
+def import_plotly():
+    global px, go, pio
+    if pio is None:
+        with profiling.phase("plotly import"):
+            import plotly.express as px
+            import plotly.graph_objects as go
+            import plotly.io as pio
+
+
+def invalidate(version=None):
+    ''' Drops cached specs of one dataset version, or all of them (memory and disk) '''
+    with lock:
+        for key in [key for key in specs if version is None or key[1] == version]:
+            del specs[key]
+    if DISK_CACHE and os.path.isdir(DISK_CACHE):
+        for file in os.listdir(DISK_CACHE):
+            if version is None or file.startswith(version[:16]):
+                os.remove(os.path.join(DISK_CACHE, file))
+
+
+SCOPES = {"group_map": ("major_group", 0), "location_scatter": ("period", 0), "location_heatmap": ("period", 0)}  # See aggregates.SCOPES
+
+
+def refreshed(old_version, new_version, changed):
+    ''' Keeps the specs no species changed by an incremental refresh affects, for the new version (memory only) '''
+    with lock:
+        return aggregates.rekey(specs, SCOPES, old_version, new_version, changed)
+
+
+def disk_path(key):
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()
+    return os.path.join(DISK_CACHE, f"{key[1][:16]}-{key[0]}-{digest}.json")
+
+
+def figure(func):
+    @functools.wraps(func)
+    def wrapper(dino, *args):
+        key = aggregates.cache_key(func.__name__, dino, *args)
+        with lock:
+            if key in specs:
+                specs.move_to_end(key)
+                return specs[key]
+        if DISK_CACHE and os.path.exists(disk_path(key)):
+            with open(disk_path(key), encoding="utf-8") as f:
+                spec = f.read()
+        else:
+            import_plotly()
+            start = time.perf_counter()
+            with profiling.timed("figure", len(dino)):
+                spec = pio.to_json(func(dino, *args), validate=False)
+            elapsed = time.perf_counter() - start
+            with lock:
+                stats = build_times.setdefault(func.__name__, [0, 0.0, 0])
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = len(spec)
+            if DISK_CACHE:
+                os.makedirs(DISK_CACHE, exist_ok=True)
+                with open(disk_path(key), "w", encoding="utf-8") as f:
+                    f.write(spec)
+        with lock:
+            aggregates.remember(specs, key, spec, max_bytes=MAX_CACHE_BYTES)
+        return spec
+    return wrapper
+
+
+''' plotly_chart() sends the cached spec string in a PlotlyChart proto of its own, through the private
+st._main._enqueue: st.plotly_chart only takes a figure (or a dict), which it would serialize to JSON again on every
+rerun. The proto and _enqueue aren't public API, so this is only done on the Streamlit versions it was checked
+against (PREBUILT_STREAMLIT) and when they still have the same fields, anything else gets st.plotly_chart with the
+decoded spec: slower, but it keeps working after an upgrade. '''
+PREBUILT_STREAMLIT = ((1, 16), (1, 23))  # Oldest and newest minor version checked
+
+
+def prebuilt_proto():
+    ''' The PlotlyChart proto class when specs can be sent as they are, None otherwise '''
+    try:
+        version = tuple(int(part) for part in st.__version__.split(".")[:2])
+        from streamlit.proto.PlotlyChart_pb2 import PlotlyChart
+    except (ValueError, ImportError):
+        return None
+    fields = PlotlyChart.DESCRIPTOR.fields_by_name
+    if not PREBUILT_STREAMLIT[0] <= version <= PREBUILT_STREAMLIT[1] or not callable(getattr(getattr(st, "_main", None), "_enqueue", None)):
+        return None
+    if not {"figure", "use_container_width", "theme"} <= set(fields) or not {"spec", "config"} <= set(fields["figure"].message_type.fields_by_name):
+        return None
+    return PlotlyChart
+
+
+PlotlyChartProto = prebuilt_proto()
+
+
+def plotly_chart(spec, use_container_width=True):
+    ''' st.plotly_chart for a prebuilt spec, in whatever container is active '''
+    if PlotlyChartProto is None:
+        return st.plotly_chart(json.loads(spec), use_container_width=use_container_width)
+    proto = PlotlyChartProto()
+    proto.figure.spec = spec
+    proto.figure.config = CHART_CONFIG
+    proto.use_container_width = use_container_width
+    proto.theme = "streamlit"
+    return st._main._enqueue("plotly_chart", proto)
+
+
+def builds():
+    ''' Copy of build_times, {figure: [builds, total seconds, last spec size]} '''
+    with lock:
+        return {name: list(stats) for name, stats in build_times.items()}
+
+
+def report():
+    ''' Build time per figure, most expensive first (shown in profiling.debug_panel()) '''
+    rows = sorted(builds().items(), key=lambda item: item[1][1], reverse=True)
+    lines = [f"{'figure':24} {'builds':>6} {'total ms':>10} {'avg ms':>8} {'spec KB':>8}"]
+    for name, (count, total, size) in rows:
+        lines.append(f"{name:24} {count:6} {total * 1000:10.1f} {total * 1000 / count:8.1f} {size / 1024:8.1f}")
+    return "\n".join(lines)
+
+
+####################################################################################################
+#######################################    FIGURE BUILDERS    ######################################
+####################################################################################################
+
+
+@figure
+def size_comparison(dino, row):
+    ''' Length of the species in row position `row` against a human, keyed on the row rather than on a name lookup '''
+    selected_dino = dino.iloc[[row]]
+    fig_size_comparison = px.timeline(selected_dino, x_start=selected_dino["length"]-selected_dino["length"], x_end=selected_dino["length"], height=175)
+    fig_size_comparison.update_layout(yaxis={'visible': False}, xaxis={"type": "linear"})
+    fig_size_comparison.data[0].x = selected_dino["length"].tolist()
+    fig_size_comparison.add_shape(type="line", x0=0, y0=0, x1=1.8, y1=0, line=dict(color="red", width=8,))
+    return fig_size_comparison
+
+
+''' ALL DINOSAURS scatter: px.scatter with color="name" makes one trace per species, so its payload and the browser
+render time grow with every row. Colored by major group, or above LOD_THRESHOLD sized species, it is drawn as one
+WebGL trace per major group instead, so the legend names the groups: the species themselves while there are few
+enough of them, otherwise the cells of aggregates.binned_sizes() (sized by the number of species in them, names of
+the first three on hover, each cell in the trace of its most common group).
+Narrowing the geological time slider re-bins the window, so zooming in refines the cells down to single species.'''
+LOD_THRESHOLD = 500  # One trace per species (first build, python figures.py): 283 traces 1.5s 116KB (the real dataset),
+# 916 traces 2.7s 386KB, 1833 traces 7.0s 744KB, 9204 traces 32s 3.6MB. The WebGL traces stay under 0.1s and 100KB
+
+
+def group_colors(dino, groups):
+    palette = px.colors.qualitative.Alphabet + px.colors.qualitative.Dark24
+    order = {group: i for i, group in enumerate(dino["major_group"].cat.categories)}
+    return [palette[order.get(group, 0) % len(palette)] for group in groups]
+
+
+@figure
+def all_dinosaurs(dino, color_by="name"):
+    non_0_size_dinos = aggregates.non_0_size(dino)
+    labels = {"name": "Species", "period_to": "Mln years ago", "length": "Size"}
+    if color_by == "name" and len(non_0_size_dinos) <= LOD_THRESHOLD:
+        fig_all = px.scatter(non_0_size_dinos, x=non_0_size_dinos["period_to"], y=non_0_size_dinos["length"], size=non_0_size_dinos["length"], color="name", labels=labels)
+        fig_all.update_xaxes(autorange="reversed")
+        return fig_all
+
+    if len(non_0_size_dinos) <= LOD_THRESHOLD:
+        points = non_0_size_dinos[["period_to", "length", "major_group", "name"]].astype({"major_group": str})
+        size, hover = points["length"], "%{text}<br>Mln years ago=%{x}<br>Size=%{y}m<br>%{customdata[0]}<extra></extra>"
+        customdata = points[["major_group"]]
+    else:
+        points = aggregates.binned_sizes(dino)
+        size, hover = points["species"], "%{customdata[1]} species: %{text}...<br>about %{x:.0f} mln years ago, %{y:.1f}m<br>mostly %{customdata[0]}<extra></extra>"
+        customdata = points[["major_group", "species"]]
+    fig_all = go.Figure()
+    text, customdata, sizeref = points["names" if "names" in points else "name"], customdata.to_numpy(), 2 * size.max() / 20 ** 2
+    group_rows = points.groupby("major_group").indices
+    for group in [group for group in dino["major_group"].cat.categories if group in group_rows]:  # One trace per group, so the legend names them
+        rows = group_rows[group]
+        fig_all.add_trace(go.Scattergl(
+            x=points["period_to"].iloc[rows], y=points["length"].iloc[rows], mode="markers", name=group, text=text.iloc[rows],
+            customdata=customdata[rows], hovertemplate=hover,
+            marker={"size": size.iloc[rows], "sizemode": "area", "sizeref": sizeref, "color": group_colors(dino, [group])[0], "opacity": 0.8},
+        ))
+    fig_all.update_layout(xaxis_title=labels["period_to"], yaxis_title=labels["length"], legend_title_text="Major group")
+    fig_all.update_xaxes(autorange="reversed")
+    return fig_all
+
+
+@figure
+def groups_sunburst(dino, with_species):
+    path = ("type", "major_group", "name") if with_species else ("type", "major_group")
+    return px.sunburst(aggregates.sunburst_paths(dino, path), path=list(path), template="presentation")
+
+
+@figure
+def major_groups_timeline(dino):
+    major_group_ranges = aggregates.major_group_ranges(dino)
+    fig_timeline = px.timeline(major_group_ranges, x_start="period_from", x_end="period_to", y="major_group", text="major_group", labels={"major_group": "Major group", "period_from": "From (mln years ago)", "period_to": "To (mln years ago)"})
+    fig_timeline.update_layout(xaxis_title="MLN years ago", yaxis={'visible': False}, xaxis={"type": "linear"})
+    fig_timeline.update_xaxes(autorange="reversed")
+    fig_timeline.data[0].x = major_group_ranges.delta.tolist()
+    return fig_timeline
+
+
+@figure
+def group_map(dino, group, show_counts):
+    group_diversity = aggregates.group_locations(dino, group)
+    color_setting = group_diversity["species"] if show_counts else group_diversity["lived_in"]
+    return px.choropleth(group_diversity, locations="iso3", color=color_setting, locationmode="ISO-3", hover_name="lived_in", labels={"lived_in": "Location", "species": f"Species of {group} discovered"})
+
+
+@figure
+def location_scatter(dino, period, title):
+    return px.scatter_geo(aggregates.locations(dino, period), locations="iso3", locationmode="ISO-3", color="lived_in", size="species", text="species", size_max=50, labels={"lived_in": "Location", "species": "Species discovered"}, title=title)
+
+
+@figure
+def location_heatmap(dino, period, title):
+    return px.choropleth(aggregates.locations(dino, period), locations="iso3", locationmode="ISO-3", color="species", hover_name="lived_in", labels={"lived_in": "Location", "species": "Species discovered"}, title=title)
+
+
+@figure
+def sizes_in_groups(dino):
+    largest_in_family, average_in_family, smallest_in_family = aggregates.sizes_in_groups(dino)
+    bar_largest = go.Bar(x=largest_in_family["major_group"], y=np.round(largest_in_family["length"], 2), name="Largest in group")
+    bar_average = go.Bar(x=average_in_family["major_group"], y=np.round(average_in_family["length"], 2), name="Average size in group")
+    bar_smallest = go.Bar(x=smallest_in_family["major_group"], y=np.round(smallest_in_family["length"], 2), name="Smallest in group")
+    fig_sizes = go.Figure()
+    fig_sizes.add_traces(bar_largest)
+    fig_sizes.add_traces(bar_average)
+    fig_sizes.add_traces(bar_smallest)
+    return fig_sizes
+
+
+@figure
+def sauropod_sizes(dino):
+    fig_sauropods = px.line(aggregates.sauropod_sizes(dino), x="age", y="size", labels={"age": "Mln years ago", "size": "Average sauropod size"}, line_shape="spline")
+    fig_sauropods.update_layout(showlegend=False)
+    fig_sauropods.update_xaxes(autorange="reversed")
+    return fig_sauropods
+
+
+@figure
+def trex(dino):
+    fig_trex = px.bar(aggregates.largest_theropods(dino), x="name", y="length")
+    fig_trex["data"][0]["marker"]["color"] = ["red" if fig_data == "tyrannosaurus" else "#636efa" for fig_data in fig_trex["data"][0]["x"]]
+    return fig_trex
+
+
+@figure
+def diversity(dino):
+    fig_diversity = px.scatter(aggregates.diversity(dino), x="Fossils age", y="Number of species", text="Number of species", size="Number of species", size_max=50, color="Number of species")
+    fig_diversity.update_xaxes(autorange="reversed")
+    fig_diversity.update_layout(xaxis_title="MLN years ago", yaxis_title="Number of species", showlegend=False)
+    return fig_diversity
+
+
+@figure
+def discoveries(dino):
+    fig_discoveries = px.bar(aggregates.discoveries(dino), x="Year", y="Species", color="Species")
+    fig_discoveries.update_layout(xaxis_title="Year", yaxis_title="Number of discoveries")
+    return fig_discoveries
+
+
+@figure
+def lifeline(dino):
+    dino_lifeline = aggregates.lifeline(dino)
+    lifeline_fig = px.scatter(dino_lifeline, x="years", y="species", animation_frame="years", range_x=[dino_lifeline["years"].max() + 1, dino_lifeline["years"].min()], range_y=[-4, int(dino_lifeline["species"].max() * 1.1) + 4], color_discrete_sequence=["red"], labels={"years": "Mln years ago", "species": "Number of species present"})
+    if lifeline_fig.layout.updatemenus:  # No play button for a single year
+        lifeline_fig.layout.updatemenus[0].buttons[0].args[1]['frame']['duration'] = 40
+    lifeline_fig.add_vline(x=64, line_width=2, line_color="red", line_dash="dash", annotation_text="K-Pg Extinction Event")
+    return lifeline_fig
+
+
+def benchmark(sizes=(300, 10_000, 1_000_000)):
+    ''' Build time and JSON payload of the all-dinosaurs scatter: one trace per species vs. the WebGL level of detail.
+    300 is the real dataset, the larger ones come from synthetic.py. Browser render time grows with the traces and
+    markers in the payload, which are printed too. '''
+    import dataset
+    import synthetic
+    global LOD_THRESHOLD
+
+    import_plotly()
+    default = LOD_THRESHOLD
+    for size in sizes:
+        dino = dataset.get() if size == 300 else dataset.clean(synthetic.generate(size))
+        dino.attrs["version"] = f"benchmark-{size}"
+        modes = [("per species", 10 ** 9, "name"), ("level of detail", default, "name"), ("by major group", default, "major_group")]
+        for label, LOD_THRESHOLD, color_by in modes[size > 10_000:]:  # A million traces would not build at all
+            start = time.perf_counter()
+            spec = pio.to_json(all_dinosaurs.__wrapped__(dino, color_by), validate=False)
+            elapsed = time.perf_counter() - start
+            data = json.loads(spec)["data"]
+            print(f"{size:>9} rows  {label:15} {elapsed:7.2f}s  {len(spec) / 1024:9.1f}KB  {len(data):6} traces  {sum(len(trace['x']) for trace in data):7} markers")
+    LOD_THRESHOLD = default
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,116 @@
+import numpy as np
+
+import aggregates
+
+####################################################################################################
+##################################    LOOKUP INDEXES FOR SELECTORS    ##############################
+####################################################################################################
+''' The species / group selectors and the image grid used to scan the whole frame with a boolean mask for every
+lookup (once per image in the grid). DinoIndex is built once per dataset version and turns those into dictionary
+lookups and row position arrays, so a selection costs O(1) or O(rows in the group).'''
+
+
+class DinoIndex:
+    def __init__(self, dino):
+        reversed_rows = range(len(dino) - 1, -1, -1)  # Filled from the end, so the first row wins on duplicates like .loc[...].iloc[0]
+        self.name_to_row = dict(zip(dino["name"].to_numpy()[::-1], reversed_rows))
+        self.image_to_name = dict(zip(dino["image"].to_numpy()[::-1], dino["name"].to_numpy()[::-1]))
+        self.group_rows = dino.groupby("major_group", observed=True).indices
+
+        ''' Non-zero lengths of each group sorted ascending (stable, so ties keep row order) for the size records '''
+        lengths = dino["length"].to_numpy()
+        self.group_sizes = {}
+        for group, rows in self.group_rows.items():
+            rows = rows[lengths[rows] != 0]
+            order = np.argsort(lengths[rows], kind="stable")
+            self.group_sizes[group] = (rows[order], lengths[rows][order])
+
+    def row(self, name):
+        return self.name_to_row[name]
+
+    def group(self, group):
+        return self.group_rows.get(group, np.empty(0, dtype=int))
+
+    def size_records(self, group):
+        ''' Row positions of the smallest and largest species in the group (first one on ties) and the mean size, None
+        when no species of the group has a known length (e.g. in a short time window) '''
+        rows, lengths = self.group_sizes.get(group, (None, ()))
+        if not len(lengths):
+            return None
+        first_largest = np.searchsorted(lengths, lengths[-1], side="left")
+        return rows[0], rows[first_largest], lengths.mean()
+
+
+@aggregates.cached
+def get(dino):
+    return DinoIndex(dino)
+
+
+def benchmark(sizes=(10_000, 1_000_000), lookups=100):
+    ''' Boolean scans vs. index lookups on the real dataset repeated to `size` rows '''
+    import time
+
+    import dataset
+
+    for size in sizes:
+        dino = dataset.dino.iloc[np.arange(size) % len(dataset.dino)].reset_index(drop=True)
+        dino["name"] = dino["name"] + (dino.index // len(dataset.dino)).astype(str)
+        dino["image"] = dino["image"] + (dino.index // len(dataset.dino)).astype(str)
+        names = dino["name"].sample(lookups, random_state=0).tolist()
+        start = time.perf_counter()
+        index = DinoIndex(dino)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for name in names:
+            dino.loc[dino["name"] == name]
+        scan = (time.perf_counter() - start) / lookups
+        start = time.perf_counter()
+        for name in names:
+            dino.iloc[[index.row(name)]]
+        lookup = (time.perf_counter() - start) / lookups
+        print(f"{size:>9} rows  build {build * 1000:8.1f}ms  name scan {scan * 1e6:9.1f}us  name lookup {lookup * 1e6:7.1f}us")
+
+        group = dino["major_group"].iloc[0]
+        images = dino["image"].iloc[index.group(group)[:50]]
+        start = time.perf_counter()
+        [dino["name"].loc[dino["image"] == image].iloc[0] for image in images]
+        scan = time.perf_counter() - start
+        start = time.perf_counter()
+        [index.image_to_name[image] for image in images]
+        lookup = time.perf_counter() - start
+        print(f"{'':>9}       50 grid images: scan {scan * 1000:8.1f}ms  lookup {lookup * 1000:7.3f}ms")
+
+
+def verify_size_records():
+    ''' size_records() against boolean scans for every group in every distinct time window of the real dataset '''
+    import dataset
+
+    dino = dataset.get()
+    start, end = aggregates.time_range(dino)
+    index = aggregates.time_index(dino)
+    windows = {index.overlapping(low, high).tobytes(): (low, high) for low in range(start, end + 1) for high in range(low, end + 1)}
+    pairs = empty = 0
+    for low, high in windows.values():
+        window = aggregates.time_window(dino, low, high)
+        window_index = DinoIndex(window)
+        groups, sizes = window["major_group"].to_numpy(), window["length"].to_numpy(dtype=float)
+        for group in window_index.group_rows:
+            lengths = np.where((groups == group) & (sizes != 0), sizes, np.nan)
+            records = window_index.size_records(group)
+            pairs += 1
+            if np.isnan(lengths).all():
+                assert records is None, (low, high, group)
+                empty += 1
+                continue
+            smallest, largest, average = records
+            assert (smallest, largest) == (np.nanargmin(lengths), np.nanargmax(lengths)) and np.isclose(average, np.nanmean(lengths)), (low, high, group)
+    print(f"{len(windows)} time windows, {pairs} (window, group) pairs: size records match, {empty} groups without sizes")
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["verify"]:
+        verify_size_records()
+    else:
+        benchmark()
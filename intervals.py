@@ -0,0 +1,128 @@
+import numpy as np
+
+####################################################################################################
+###################################    TIME INTERVAL ENGINE    #####################################
+####################################################################################################
+''' Every species lived during a closed range of time [low, high] (mln years ago, from period_from / period_to).
+IntervalIndex answers "how many species were alive at T" and "how many overlap [T1, T2]" with two binary searches
+in the sorted range ends (the prefix sums of a sweep line), for one T or a whole array of them at once.
+"Which species" queries go through a centered interval tree: a node keeps the ranges containing its center point
+sorted by both ends, so a query walks one path down the tree and only reads the ranges it returns. Small nodes
+are scanned directly. Both are built once per dataset version and answer in O(log n + returned ranges).'''
+
+LEAF_SIZE = 64
+
+
+class Node:
+    def __init__(self, ids, low, high):
+        self.center = None
+        if len(ids) > LEAF_SIZE:
+            self.center = np.median(np.concatenate([low[ids], high[ids]]))
+            here = ids[(low[ids] <= self.center) & (high[ids] >= self.center)]
+            left, right = ids[high[ids] < self.center], ids[low[ids] > self.center]
+            if len(left) == len(ids) or len(right) == len(ids):  # Can't happen with a median center, but never recurse forever
+                self.center = None
+        if self.center is None:  # Leaf, scanned directly
+            self.ids, self.low, self.high = ids, low[ids], high[ids]
+            return
+        by_low = here[np.argsort(low[here], kind="stable")]
+        by_high = here[np.argsort(high[here], kind="stable")]
+        self.by_low, self.lows = by_low, low[by_low]
+        self.by_high, self.highs = by_high, high[by_high]
+        self.left = Node(left, low, high) if len(left) else None
+        self.right = Node(right, low, high) if len(right) else None
+
+    def stab(self, t, found):
+        node = self
+        while node is not None:
+            if node.center is None:
+                found.append(node.ids[(node.low <= t) & (node.high >= t)])
+                return
+            if t < node.center:  # Ranges here end after t, those starting at or before t contain it
+                found.append(node.by_low[:np.searchsorted(node.lows, t, side="right")])
+                node = node.left
+            elif t > node.center:  # Ranges here start before t, those ending at or after t contain it
+                found.append(node.by_high[np.searchsorted(node.highs, t, side="left"):])
+                node = node.right
+            else:
+                found.append(node.by_low)
+                return
+
+
+class IntervalIndex:
+    def __init__(self, low, high):
+        self.low = np.asarray(low, dtype=float)
+        self.high = np.asarray(high, dtype=float)
+        self.by_low = np.argsort(self.low, kind="stable")
+        self.sorted_low = self.low[self.by_low]
+        self.sorted_high = np.sort(self.high)
+        self.tree = Node(np.arange(len(self.low)), self.low, self.high)
+
+    def __len__(self):
+        return len(self.low)
+
+    def count_alive(self, t):
+        ''' Number of ranges containing t (a number or an array of them) '''
+        return np.searchsorted(self.sorted_low, t, side="right") - np.searchsorted(self.sorted_high, t, side="left")
+
+    def count_overlapping(self, t1, t2):
+        ''' Number of ranges sharing at least one point with [t1, t2]: started by t2, minus those over before t1 '''
+        return np.searchsorted(self.sorted_low, t2, side="right") - np.searchsorted(self.sorted_high, t1, side="left")
+
+    def alive(self, t):
+        ''' Sorted row positions of the ranges containing t '''
+        found = []
+        self.tree.stab(t, found)
+        return np.sort(np.concatenate(found)) if found else np.empty(0, dtype=int)
+
+    def overlapping(self, t1, t2):
+        ''' Sorted row positions of the ranges sharing at least one point with [t1, t2]:
+        the ones containing t1 plus the ones starting in (t1, t2] '''
+        found = []
+        self.tree.stab(t1, found)
+        found.append(self.by_low[np.searchsorted(self.sorted_low, t1, side="right"):np.searchsorted(self.sorted_low, t2, side="right")])
+        return np.sort(np.concatenate(found))
+
+
+def from_periods(dino):
+    ''' Index over the ranges of the species in dino. period_from is the older end, except where the "+10" rule
+    of dataset.parse_periods() made period_to the larger number, so each range is ordered here. '''
+    period_from, period_to = dino["period_from"].to_numpy(dtype=float), dino["period_to"].to_numpy(dtype=float)
+    return IntervalIndex(np.minimum(period_from, period_to), np.maximum(period_from, period_to))
+
+
+def benchmark(sizes=(10_000, 1_000_000, 5_000_000), queries=100):
+    ''' Random occurrence ranges: index build, then count / which queries against boolean scans '''
+    import time
+
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        low = rng.uniform(66, 252, size).round(1)
+        high = low + rng.exponential(5, size).round(1)
+        start = time.perf_counter()
+        index = IntervalIndex(low, high)
+        build = time.perf_counter() - start
+        times = rng.uniform(66, 252, queries)
+
+        start = time.perf_counter()
+        scans = [np.flatnonzero((low <= t) & (high >= t)) for t in times]
+        scan = (time.perf_counter() - start) / queries
+        start = time.perf_counter()
+        found = [index.alive(t) for t in times]
+        which = (time.perf_counter() - start) / queries
+        assert all(np.array_equal(a, b) for a, b in zip(scans, found))
+        start = time.perf_counter()
+        counts = index.count_alive(times)
+        count = (time.perf_counter() - start) / queries
+        assert np.array_equal(counts, [len(rows) for rows in scans])
+
+        start = time.perf_counter()
+        overlaps = [index.overlapping(t, t + 10) for t in times]
+        overlap = (time.perf_counter() - start) / queries
+        assert all(np.array_equal(rows, np.flatnonzero((low <= t + 10) & (high >= t))) for rows, t in zip(overlaps[:5], times))
+        print(f"{size:>9} ranges  build {build:6.2f}s  scan {scan * 1000:7.2f}ms  alive {which * 1000:6.2f}ms "
+              f"(~{np.mean([len(rows) for rows in found]):.0f} rows)  overlap 10My {overlap * 1000:6.2f}ms  count {count * 1e6:5.2f}us")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,111 @@
+import os
+
+from pympler import asizeof
+from pympler.process import ProcessMemoryInfo
+
+####################################################################################################
+#####################################    MEMORY REPORT    ##########################################
+####################################################################################################
+''' Resident memory of this process (RSS through Pympler) and, on Linux, how much of it is shared with other
+processes. PSS splits every shared page between the processes mapping it, so the PSS of all Streamlit workers on a
+host adds up to the memory they really use, while their RSS counts the memory-mapped dataset once per worker.
+python memory.py loads a large synthetic dataset in several processes at once, once from Parquet into Python
+strings (how every worker used to hold the dataset) and once from the memory-mapped Arrow artifact.'''
+
+MB = 1024 * 1024
+
+
+def smaps_rollup():
+    ''' {field: bytes} from /proc/self/smaps_rollup, empty where it doesn't exist '''
+    try:
+        with open("/proc/self/smaps_rollup", encoding="ascii") as f:
+            lines = [line.split() for line in f if line.rstrip().endswith("kB")]
+    except OSError:
+        return {}
+    return {fields[0].rstrip(":"): int(fields[1]) * 1024 for fields in lines}
+
+
+def report():
+    ''' {"rss", "pss", "shared", "private"} in bytes (only "rss" outside Linux) '''
+    memory = {"rss": ProcessMemoryInfo().rss}
+    rollup = smaps_rollup()
+    if rollup:
+        memory["pss"] = rollup.get("Pss", 0)
+        memory["shared"] = rollup.get("Shared_Clean", 0) + rollup.get("Shared_Dirty", 0)
+        memory["private"] = rollup.get("Private_Clean", 0) + rollup.get("Private_Dirty", 0)
+    return memory
+
+
+def caches():
+    ''' Approximate bytes held by the dataset and the process-wide caches '''
+    import sys
+    sizes = {}
+    if getattr(sys.modules.get("dataset"), "loaded", None) is not None:
+        dino = sys.modules["dataset"].loaded
+        in_arrow = [column for column in dino if str(dino[column].dtype) == "string"]  # string[pyarrow], in the mapped file
+        sizes["dataset (memory-mapped text)"] = int(dino[in_arrow].memory_usage(index=False).sum())
+        sizes["dataset (in process)"] = int(dino.drop(columns=in_arrow).memory_usage(deep=True).sum())
+    for module, attribute in (("aggregates", "store"), ("figures", "specs"), ("exports", "files")):
+        if module in sys.modules:
+            sizes[f"{module}.{attribute}"] = asizeof.asizeof(getattr(sys.modules[module], attribute))
+    return sizes
+
+
+def describe(memory):
+    return ", ".join(f"{key} {value / MB:.1f}MB" for key, value in memory.items())
+
+
+def measure(loader, path, barrier, results):
+    ''' Worker of benchmark(): RSS before and after loading the dataset, while every worker holds its copy '''
+    import pyarrow.parquet as pq
+
+    import dataset
+
+    before = report()
+    if loader == "parquet":
+        dino = pq.read_table(path).to_pandas()
+    else:
+        dino = dataset.load_artifact(artifact=path, version="benchmark")
+    dino["taxonomy"].str.contains("Theropoda").sum()  # Read the text like the app does
+    barrier.wait()
+    after = report()
+    barrier.wait()  # Nobody exits before every worker is measured
+    results.put((before, after))
+
+
+def benchmark(rows=1_000_000, workers=3):
+    import multiprocessing
+    import tempfile
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    import dataset
+    import synthetic
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dino = dataset.clean(synthetic.generate(rows))
+        parquet, artifact = os.path.join(tmp, "dino.parquet"), os.path.join(tmp, "dino.arrow")
+        pq.write_table(pa.Table.from_pandas(dino), parquet)
+        dataset.write_artifact(dino, artifact, "benchmark")
+        del dino
+        print(f"{rows} rows: Parquet {os.path.getsize(parquet) / MB:.0f}MB, Arrow artifact {os.path.getsize(artifact) / MB:.0f}MB")
+
+        context = multiprocessing.get_context("spawn")
+        for loader, path in (("parquet", parquet), ("arrow mmap", artifact)):
+            barrier, results = context.Barrier(workers), context.Queue()
+            processes = [context.Process(target=measure, args=(loader, path, barrier, results)) for _ in range(workers)]
+            for process in processes:
+                process.start()
+            measured = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+            print(f"{loader}, {workers} processes:")
+            for before, after in measured:
+                print(f"  before {describe(before)}\n  after  {describe(after)}")
+            if "pss" in measured[0][1]:
+                print(f"  total PSS of all processes: {sum(after['pss'] for _, after in measured) / MB:.0f}MB")
+
+
+if __name__ == "__main__":
+    benchmark()
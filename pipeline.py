@@ -0,0 +1,138 @@
+import glob
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import dataset
+
+####################################################################################################
+##############################    CHUNKED, MULTI-CORE CLEANING PIPELINE    #########################
+####################################################################################################
+''' For imports far bigger than dino_updated.csv (e.g. merged occurrence dumps with millions of rows). The CSV is
+read CHUNK_ROWS rows at a time and every chunk goes through dataset.STAGES in a worker process, which writes it
+to <output>/part-<n>.parquet (its rejects to <output>/_rejects/part-<n>.csv). At most two chunks per worker are in
+flight, so memory depends on the chunk size and the number of workers, not on the size of the input.
+pq.read_table(output) reads the partitions back as one table (the "_rejects" directory is skipped). All partitions
+share SCHEMA, so a chunk where a column happens to be empty still matches the others.'''
+
+CHUNK_ROWS = 100_000
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([
+    ("name", pa.string()), ("species", pa.string()), ("type", CATEGORY), ("length", pa.float64()), ("diet", CATEGORY),
+    ("period", CATEGORY), ("period_from", pa.int16()), ("period_to", pa.int16()), ("lived_in", CATEGORY),
+    ("discovered", pa.int64()), ("major_group", CATEGORY), ("taxonomy", pa.string()), ("named_by", pa.string()),
+    ("link", pa.string()), ("image", pa.string()), ("row", pa.int64()),  # row: index of the source CSV
+])
+
+
+def clean_partition(number, chunk, output):
+    ''' Runs in a worker. Returns (rows in, rows out, rejected rows, {stage: seconds}) '''
+    rejects, timings = [], {}
+    cleaned = dataset.clean(chunk.rename_axis("row"), rejects, timings)
+    start = time.perf_counter()
+    if len(cleaned):
+        pq.write_table(pa.Table.from_pandas(cleaned, schema=SCHEMA, preserve_index=True), os.path.join(output, f"part-{number:05d}.parquet"))
+    if rejects:
+        pd.concat(rejects).to_csv(os.path.join(output, "_rejects", f"part-{number:05d}.csv"))
+    timings["write"] = time.perf_counter() - start
+    return len(chunk), len(cleaned), sum(map(len, rejects)), timings
+
+
+def run(source, output, workers=None, chunk_rows=CHUNK_ROWS):
+    ''' Cleans `source` into partitions in the `output` directory. Returns the totals and the seconds per stage '''
+    workers = workers or os.cpu_count()
+    os.makedirs(os.path.join(output, "_rejects"), exist_ok=True)
+    for old in glob.glob(os.path.join(output, "part-*.parquet")) + glob.glob(os.path.join(output, "_rejects", "part-*.csv")):
+        os.remove(old)
+
+    report = {"workers": workers, "chunks": 0, "rows in": 0, "rows out": 0, "rejected": 0, "stages": {"csv parse": 0.0}}
+
+    def collect(done):
+        for future in done:
+            rows_in, rows_out, rejected, timings = future.result()
+            report["rows in"] += rows_in
+            report["rows out"] += rows_out
+            report["rejected"] += rejected
+            for stage, seconds in timings.items():
+                report["stages"][stage] = report["stages"].get(stage, 0.0) + seconds
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        reader = pd.read_csv(source, index_col=0, chunksize=chunk_rows)
+        while True:
+            parse_start = time.perf_counter()
+            chunk = next(reader, None)
+            report["stages"]["csv parse"] += time.perf_counter() - parse_start
+            if chunk is None:
+                break
+            pending.add(pool.submit(clean_partition, report["chunks"], chunk, output))
+            report["chunks"] += 1
+            if len(pending) >= 2 * workers:  # Bounded memory: wait for a worker before reading on
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(wait(pending).done)
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def load(output):
+    ''' The partitions in `output` as one DataFrame, like dataset.clean() returns it (indexed by source row) '''
+    return pq.read_table(output).to_pandas()
+
+
+def throughput(report):
+    ''' Rows per second of every stage (seconds summed over all workers) and of the whole run '''
+    lines = [f"{report['rows in']} rows in {report['chunks']} chunks, {report['workers']} workers: {report['seconds']:.2f}s "
+             f"({report['rows in'] / report['seconds']:,.0f} rows/s), {report['rows out']} cleaned, {report['rejected']} rejected"]
+    for stage, seconds in report["stages"].items():
+        lines.append(f"  {stage:12} {seconds:7.2f}s  {report['rows in'] / seconds if seconds else float('inf'):>12,.0f} rows/s")
+    return "\n".join(lines)
+
+
+def verify(source, output):
+    ''' The partitions must hold the same rows and values as cleaning the whole CSV at once '''
+    plain = {column: object for column in dataset.CATEGORICAL_COLUMNS}  # Categories are unified in another order
+    expected = dataset.clean(dataset.read_source(source)).astype(plain).rename_axis("row")
+    pd.testing.assert_frame_equal(load(output).sort_index().astype(plain), expected)
+
+
+def benchmark(rows=1_000_000, workers=None, chunk_rows=CHUNK_ROWS, check_rows=200_000):
+    ''' Synthetic CSV of `rows` rows cleaned with 1 to N workers: throughput per stage and scaling.
+    The output is checked against dataset.clean() of the whole CSV when rows <= check_rows. '''
+    import tempfile
+
+    import synthetic
+
+    workers = workers or sorted({1, 2, 4, os.cpu_count()})
+    with tempfile.TemporaryDirectory() as tmp:
+        source = synthetic.write_csv(os.path.join(tmp, "synthetic.csv"), rows)
+        output = os.path.join(tmp, "clean")
+        baseline = None
+        for count in workers:
+            report = run(source, output, count, chunk_rows)
+            baseline = baseline or report["seconds"]
+            print(throughput(report))
+            print(f"  speedup vs 1 worker: {baseline / report['seconds']:.2f}x")
+        if rows <= check_rows:
+            verify(source, output)
+            print("partitions match dataset.clean() of the whole CSV")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Clean a large dino CSV into Parquet partitions")
+    parser.add_argument("source", nargs="?", help="CSV to clean; without it, benchmark on a synthetic CSV")
+    parser.add_argument("output", nargs="?", default="./dino_partitions")
+    parser.add_argument("--workers", type=int, nargs="+", help="worker counts (one for a run, several for the benchmark)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="synthetic rows for the benchmark")
+    args = parser.parse_args()
+    if args.source:
+        print(throughput(run(args.source, args.output, args.workers and args.workers[0], args.chunk_rows)))
+    else:
+        benchmark(args.rows, args.workers, args.chunk_rows)
@@ -0,0 +1,225 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+####################################################################################################
+#####################################    STARTUP PROFILER    #######################################
+####################################################################################################
+''' Cold start of the dashboard was dominated by imports and CSV work. phase() records how long each startup phase
+takes (the first time it runs in the process). Heavy modules are imported where they are first needed instead
+(plotly when a figure has to be built, the thumbnail pipeline when images are switched on), so a process that
+serves every figure from the figure cache never imports plotly at all. Modules are not replaced with lazy
+proxies in sys.modules, because streamlit's file watcher reads every module in there and would load them anyway.
+python profiling.py starts main.py in a fresh interpreter and prints the phases as JSON for CI.'''
+
+PROCESS_START = time.perf_counter()  # main.py imports this module first
+phases = {}  # {phase: seconds}, first run of each phase only
+
+
+@contextlib.contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases.setdefault(name, time.perf_counter() - start)
+
+
+def first_render_done():
+    phases.setdefault("first render", time.perf_counter() - PROCESS_START)
+
+
+def report():
+    return {name: round(seconds, 4) for name, seconds in phases.items()}
+
+
+####################################################################################################
+##################################    PER-SECTION RENDER TIMINGS    ################################
+####################################################################################################
+''' section() wraps one section of main.py and records, for every rerun, its wall time, the pandas time (aggregates
+computed instead of served from their cache), the figure build time and the rows those computations went through.
+timed() charges its time to the active section exclusively: a figure build that computes an aggregate is split
+between "figure" and "pandas". The rest of the wall time ("other") is streamlit serialization and small pandas work
+in main.py itself. Results are shown in debug_panel() and written to METRICS_FILE after every rerun, together with
+the hits and misses of the aggregates cache (a widget rerun that only hits did no pandas work) and the build times
+of the figures.
+With SECTIONS off, section() and timed() return a shared no-op context, so they can stay in the code in production.'''
+
+SECTIONS = os.environ.get("DINO_PROFILE", "") not in ("", "0")  # DINO_PROFILE=1 streamlit run main.py
+METRICS_FILE = os.environ.get("DINO_METRICS")  # "./metrics.prom" (Prometheus text) or "./metrics.json"
+KINDS = ("wall", "pandas", "figure", "other")
+
+state = threading.local()  # Active section of the script thread of this session
+totals = {}  # {section: {"runs": n, "rows": n, "wall": s, ...}} since the process started
+last_rerun = {}  # {section: {"rows": n, "wall": s, ...}} of the latest rerun of any session
+totals_lock = threading.Lock()
+
+
+NOOP = contextlib.nullcontext()  # Shared by all disabled timers, so they don't even create a generator
+
+
+def section(name):
+    return _section(name) if SECTIONS else NOOP
+
+
+def timed(kind, rows=0):
+    ''' Charges the time spent inside, minus nested timed() blocks, to `kind` of the active section '''
+    return _timed(kind, rows) if getattr(state, "section", None) is not None else NOOP
+
+
+@contextlib.contextmanager
+def _section(name):
+    record = dict.fromkeys(KINDS, 0.0)
+    record["rows"] = 0
+    state.section, state.nested = record, 0.0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record["wall"] = time.perf_counter() - start
+        record["other"] = record["wall"] - record["pandas"] - record["figure"]
+        state.section = None
+        with totals_lock:
+            last_rerun[name] = record
+            total = totals.setdefault(name, dict.fromkeys(KINDS, 0.0) | {"runs": 0, "rows": 0})
+            total["runs"] += 1
+            for key in (*KINDS, "rows"):
+                total[key] += record[key]
+
+
+@contextlib.contextmanager
+def _timed(kind, rows):
+    record = state.section
+    outer, state.nested = state.nested, 0.0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        record[kind] += elapsed - state.nested
+        record["rows"] += rows
+        state.nested = outer + elapsed
+
+
+def cache_metrics():
+    ''' {"aggregate_cache": aggregates.counters(), "figure_builds": {figure: {"builds", "seconds", "spec_bytes"}}} of
+    the modules this process has loaded (profiling itself doesn't import them) '''
+    aggregates, figures = sys.modules.get("aggregates"), sys.modules.get("figures")
+    return {
+        "aggregate_cache": aggregates.counters() if aggregates else {},
+        "figure_builds": {name: dict(zip(("builds", "seconds", "spec_bytes"), stats)) for name, stats in figures.builds().items()} if figures else {},
+    }
+
+
+def prometheus():
+    lines = ["# TYPE dino_section_seconds_total counter", "# TYPE dino_section_runs_total counter",
+             "# TYPE dino_section_rows_total counter", "# TYPE dino_section_last_seconds gauge"]
+    with totals_lock:
+        for name, total in totals.items():
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'dino_section_runs_total{{section="{label}"}} {total["runs"]}')
+            lines.append(f'dino_section_rows_total{{section="{label}"}} {total["rows"]}')
+            for kind in KINDS:
+                lines.append(f'dino_section_seconds_total{{section="{label}",kind="{kind}"}} {total[kind]:.6f}')
+                lines.append(f'dino_section_last_seconds{{section="{label}",kind="{kind}"}} {last_rerun[name][kind]:.6f}')
+    metrics = cache_metrics()
+    lines += ["# TYPE dino_cache_hits_total counter", "# TYPE dino_cache_misses_total counter"]
+    for key, count in sorted(metrics["aggregate_cache"].items()):
+        function, _, outcome = key.rpartition(".")
+        lines.append(f'dino_cache_{outcome}_total{{function="{function or "all"}"}} {count}')
+    lines += ["# TYPE dino_figure_builds_total counter", "# TYPE dino_figure_build_seconds_total counter", "# TYPE dino_figure_spec_bytes gauge"]
+    for name, build in metrics["figure_builds"].items():
+        lines.append(f'dino_figure_builds_total{{figure="{name}"}} {build["builds"]}')
+        lines.append(f'dino_figure_build_seconds_total{{figure="{name}"}} {build["seconds"]:.6f}')
+        lines.append(f'dino_figure_spec_bytes{{figure="{name}"}} {build["spec_bytes"]}')
+    return "\n".join(lines) + "\n"
+
+
+def dump(path=None):
+    ''' Writes the section metrics to `path` (METRICS_FILE by default), as JSON if it ends with .json '''
+    path = path or METRICS_FILE
+    if not path:
+        return
+    if path.endswith(".json"):
+        with totals_lock:
+            text = json.dumps({"totals": totals, "last_rerun": last_rerun, "startup": report(), **cache_metrics()}, indent=2)
+    else:
+        text = prometheus()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def debug_panel():
+    ''' Expander with the section timings of the latest rerun and the averages since startup, the cache hits, the
+    figure build times and memory use '''
+    import pandas as pd
+    import streamlit as st
+
+    import memory
+
+    with totals_lock:
+        rows = [{"section": name, **{f"{kind} ms": record[kind] * 1000 for kind in KINDS}, "rows": record["rows"],
+                 "avg wall ms": totals[name]["wall"] / totals[name]["runs"] * 1000, "runs": totals[name]["runs"]}
+                for name, record in last_rerun.items()]
+    with st.expander("DEBUG: SECTION TIMINGS", expanded=False):
+        st.dataframe(pd.DataFrame(rows).round(1))
+        st.write(f"Startup phases: {report()}")
+        st.write(f"Memory: {memory.describe(memory.report())}")
+        st.write(f"Caches: {memory.describe(memory.caches())}")
+        if "aggregates" in sys.modules:
+            st.write(f"Aggregates cache: {sys.modules['aggregates'].report()}")
+        if "figures" in sys.modules:
+            st.text(f"Figure builds:\n{sys.modules['figures'].report()}")
+
+
+def rerun_done():
+    ''' Called at the end of main.py '''
+    first_render_done()
+    if SECTIONS:
+        debug_panel()
+        dump()
+
+
+def profile_startup(rebuild=False):
+    ''' Runs main.py once in a new interpreter (streamlit bare mode) and returns its startup phases '''
+    import os
+    import subprocess
+
+    import dataset
+    if rebuild and os.path.exists(dataset.ARTIFACT):
+        os.remove(dataset.ARTIFACT)  # Measure CSV parsing and cleaning too
+    script = "import logging, runpy, json, profiling; logging.disable(logging.CRITICAL); runpy.run_path('main.py'); print(json.dumps(profiling.report()))"
+    result = subprocess.run([sys.executable, "-W", "ignore", "-c", script], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark(calls=100_000):
+    ''' Cost of one section() + timed() pair, with SECTIONS off and on '''
+    global SECTIONS
+    for SECTIONS in (False, True):
+        start = time.perf_counter()
+        for _ in range(calls):
+            with section("benchmark"), timed("pandas", 1):
+                pass
+        print(f"SECTIONS={SECTIONS!s:5}  {(time.perf_counter() - start) / calls * 1e6:.2f}us per section")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Startup phase timings of main.py")
+    parser.add_argument("--rebuild", action="store_true", help="delete the dataset artifact first (CSV parse + cleaning)")
+    parser.add_argument("--budget", type=float, help="exit with status 1 if the first render takes longer (seconds)")
+    parser.add_argument("--overhead", action="store_true", help="only measure the cost of the section timers")
+    args = parser.parse_args()
+    if args.overhead:
+        benchmark()
+        sys.exit()
+    timings = profile_startup(args.rebuild)
+    print(json.dumps(timings, indent=2))
+    if args.budget is not None and timings["first render"] > args.budget:
+        sys.exit(1)
@@ -0,0 +1,275 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import dataset
+import profiling
+
+####################################################################################################
+###############################    INCREMENTAL DATASET REFRESH    ##################################
+####################################################################################################
+''' When the NHM directory adds or corrects a few species, the source CSV changes and used to be cleaned again from
+scratch, and every cached result was dropped. build_artifact() also writes a hash of every source row, by KEY (the
+NHM link, row numbers shift when a row is inserted), to dataset.ROW_HASHES. refresh() hashes the new CSV, runs
+dataset.clean() on the inserted and changed rows only and applies them, with the deletes, to the rows of the last
+artifact. The stages only look at one row (or at distinct values) at a time, so this gives the same frame as a
+full rebuild: the categories are recomputed from the merged rows and the index is renumbered from the new CSV.
+Every change to the dataset is appended to CHANGELOG_CSV. In a running app, dataset.get() notices the changed source
+files on the next rerun and calls apply(), which swaps in the new frame and keeps the cached results and figures
+scoped to a major_group or period (aggregates.SCOPES) that no changed species had.
+Without a usable previous build (first run, PIPELINE_VERSION or major_groups.csv changed, different columns,
+missing or duplicate keys) it falls back to the full rebuild. verify() compares both on random edit scripts.'''
+
+CHANGELOG_CSV = "./dino_changelog.csv"
+DIMENSIONS = ("major_group", "lived_in", "period")  # Of the changed species, for the cache invalidation
+CHANGELOG_COLUMNS = ["time", "version", "change", "key", "name", "columns"]
+
+
+def usable_keys(keys):
+    return keys.notna().all() and keys.is_unique
+
+
+def previous_build(artifact, hashes, rejects_csv, raw):
+    ''' (cleaned frame, row hashes, rejected rows) of the last build, or None if it can't be refreshed '''
+    version = dataset.stored_metadata(artifact).get(b"source_sha256")
+    metadata = dataset.stored_metadata(hashes)
+    if version is None or metadata.get(b"source_sha256") != version or metadata.get(b"pipeline_sha256") != dataset.pipeline_hash().encode():
+        return None
+    if metadata.get(b"columns") != " ".join(raw.columns).encode() or not os.path.exists(rejects_csv):
+        return None
+    old_hashes = dataset.load_artifact(artifact=hashes, version=version.decode())
+    if old_hashes is None or not usable_keys(old_hashes["key"]):
+        return None
+    rejected = pd.read_csv(rejects_csv, index_col=0)
+    if dataset.KEY not in rejected:  # Nothing was rejected
+        rejected = pd.DataFrame(columns=[dataset.KEY])
+    return dataset.load_artifact(artifact=artifact, version=version.decode()), old_hashes, rejected
+
+
+def merge(old, fresh):
+    ''' old and freshly cleaned rows in one frame, with the dtypes of the artifact and the categories organize_columns
+    would give the merged rows '''
+    dtypes = {column: old[column].dtype for column in dataset.COLUMNS}
+    for column in dataset.CATEGORICAL_COLUMNS:
+        categories = set(old[column].cat.categories) | set(fresh[column].dropna().unique())
+        dtypes[column] = pd.CategoricalDtype(sorted(categories))
+    merged = pd.concat([old.astype(dtypes), fresh.astype(dtypes)])
+    for column in dataset.CATEGORICAL_COLUMNS:
+        merged[column] = merged[column].cat.remove_unused_categories()
+    return merged
+
+
+def changes(old, fresh, deleted, rejected, version):
+    ''' Changelog of the dataset: a row per inserted, updated (with the columns that changed), deleted or rejected
+    species. old and fresh are the rows before and after, on the key '''
+    both = fresh.index[fresh.index.isin(old.index)]
+    before, after = old.loc[both, dataset.COLUMNS].astype(object), fresh.loc[both, dataset.COLUMNS].astype(object)
+    differs = before.ne(after) & ~(before.isna() & after.isna())
+    updated = differs.any(axis=1)
+    log = [
+        pd.DataFrame({"change": "inserted", "key": fresh.index[~fresh.index.isin(old.index)]}),
+        pd.DataFrame({"change": "updated", "key": both[updated], "columns": differs[updated].dot(differs.columns + ";").str.rstrip(";")}),
+        pd.DataFrame({"change": "deleted", "key": deleted[pd.Index(deleted).isin(old.index)]}),
+        pd.DataFrame({"change": "rejected", "key": rejected}),
+    ]
+    log = pd.concat(log, ignore_index=True)
+    names = pd.concat([old["name"], fresh["name"]]).astype(object)
+    log["name"] = log["key"].map(names[~names.index.duplicated(keep="last")])
+    log.insert(0, "version", version)
+    log.insert(0, "time", time.strftime("%Y-%m-%dT%H:%M:%S%z"))
+    return log.reindex(columns=CHANGELOG_COLUMNS)
+
+
+def refresh(source=dataset.SOURCE_CSV, artifact=dataset.ARTIFACT, version=None, hashes=dataset.ROW_HASHES, rejects_csv=dataset.REJECTS_CSV, changelog_csv=CHANGELOG_CSV):
+    ''' Brings the artifact up to date with the source CSV. Returns (dino, changelog, {dimension: labels of the
+    changed species, before and after}); changelog and labels are None after a full rebuild. A process that waited for
+    another one's refresh of the artifact maps its result, with an empty changelog '''
+    version = version or dataset.source_hash(source)
+    with dataset.rebuild_lock(artifact):
+        current = dataset.load_artifact(source, artifact, version)
+        if current is not None:
+            return current, pd.DataFrame(columns=CHANGELOG_COLUMNS), {dimension: set() for dimension in DIMENSIONS}
+        with profiling.phase("csv parse"):
+            raw = dataset.read_source(source)
+        previous = previous_build(artifact, hashes, rejects_csv, raw) if usable_keys(raw[dataset.KEY]) else None
+        if previous is None:
+            return dataset.build_artifact(source, artifact, version, rejects_csv, hashes, raw), None, None
+        old, old_hashes, old_rejects = previous
+
+        ''' Rows with the same hash as before keep their cleaned row (or stay rejected), with their new row number.
+        Keys are compared as object arrays, isin() on Arrow strings goes through Python scalars. '''
+        new_hashes = dataset.row_hashes(raw)
+        new_keys = pd.Index(new_hashes["key"])
+        old_keys = old_hashes["key"].to_numpy(dtype=object)
+        old_positions = pd.Index(old_keys).get_indexer(new_keys)
+        same = (old_positions >= 0) & (old_hashes["hash"].to_numpy()[old_positions] == new_hashes["hash"].to_numpy())
+        at = new_keys.get_indexer(old[dataset.KEY].to_numpy(dtype=object))  # Position of every cleaned row in the new CSV
+        kept = old[(at >= 0) & same[at]]
+        kept.index = raw.index[at[(at >= 0) & same[at]]]
+        at = new_keys.get_indexer(old_rejects[dataset.KEY].to_numpy(dtype=object))
+        old_rejects = old_rejects[(at >= 0) & same[at]]
+        old_rejects.index = raw.index[at[(at >= 0) & same[at]]]
+
+        ''' The other rows go through the cleaning stages '''
+        rejects = []
+        dirty = raw[~same]
+        with profiling.phase("cleaning"):
+            fresh = dataset.clean(dirty.copy(), rejects)
+        rejected = pd.concat(([old_rejects] if len(old_rejects) else []) + rejects) if len(old_rejects) or rejects else pd.DataFrame(columns=["reason"])
+        position = pd.Series(np.arange(len(raw)), index=raw.index)
+        dino = merge(kept, fresh)
+        dino = dino.iloc[np.argsort(position[dino.index].to_numpy(), kind="stable")]
+        rejected = rejected.iloc[np.argsort(position[rejected.index].to_numpy(), kind="stable")]
+
+        ''' What changed in the dataset, and the major groups, countries and periods it touched '''
+        deleted = old_keys[new_keys.get_indexer(old_keys) < 0]
+        dirty_keys = dirty[dataset.KEY].to_numpy(dtype=object)
+        by_key = old.set_index(old[dataset.KEY].to_numpy(dtype=object))
+        before = by_key[by_key.index.isin(np.r_[dirty_keys, deleted])]
+        after = fresh.set_index(fresh[dataset.KEY].to_numpy(dtype=object))
+        changelog = changes(before, after, deleted, dirty_keys[~pd.Index(dirty_keys).isin(after.index)], version)
+        touched = pd.concat([before[before.index.isin(changelog["key"])], after[after.index.isin(changelog["key"])]])
+        changed = {dimension: set(touched[dimension].astype(object).dropna()) for dimension in DIMENSIONS}
+
+        try:
+            dataset.write_row_hashes(new_hashes, raw.columns, hashes, version)
+            rejected.to_csv(rejects_csv)
+            dataset.write_artifact(dino, artifact, version)  # The new row hashes and rejects only count once it is written
+            changelog.to_csv(changelog_csv, mode="a", header=not os.path.exists(changelog_csv), index=False)
+        except OSError:
+            pass  # Read-only deployment, keep using the refreshed frame
+        return dataset.mapped(dino, source, artifact, version), changelog, changed
+
+
+def apply(source=dataset.SOURCE_CSV, artifact=dataset.ARTIFACT):
+    ''' Refreshes the dataset of this process: dataset.get() returns the new version, and the cached results and
+    figures no changed species affects are kept for it. Returns the changelog (None after a full rebuild, empty when
+    the process already has the current version) '''
+    import figures
+    with dataset.load_lock:
+        old_version = dataset.loaded.attrs["version"] if dataset.loaded is not None else None
+        version = dataset.source_hash(source)
+        if old_version == version:  # Nothing to refresh, every cached result stays valid
+            return pd.DataFrame(columns=CHANGELOG_COLUMNS)
+        dino, changelog, changed = refresh(source, artifact, version)
+        dino.attrs["version"] = version
+        if changelog is not None and len(changelog) and old_version is not None:
+            aggregates.refreshed(old_version, version, changed)
+            figures.refreshed(old_version, version, changed)
+        else:  # Full rebuild, or another process refreshed the artifact and its changes aren't known here
+            aggregates.invalidate()
+            figures.invalidate()
+        dataset.loaded = dino
+    return changelog
+
+
+def edit(raw, rng, count):
+    ''' A random edit script on the source rows: inserts of copies under new keys, deletes, and updates of a column
+    to the value of another row or to one clean() rejects. Renumbers the rows like the scraper does, half the time '''
+    columns = ["name", "species", "length", "diet", "type", "period", "lived_in", "taxonomy", "named_by", "image"]
+    broken = {"period": "Unknown", "named_by": "Unknown", "lived_in": np.nan, "image": np.nan, "taxonomy": np.nan}
+    raw = raw.copy()
+    for _ in range(count):
+        kind, row = rng.integers(0, 3), int(rng.integers(0, len(raw)))
+        if kind == 0:
+            new = raw.iloc[[row]].set_axis([raw.index.max() + 1])
+            new[dataset.KEY] += f"#{rng.integers(1 << 62)}"
+            raw = pd.concat([raw.iloc[:row], new, raw.iloc[row:]])
+        elif kind == 1 and len(raw) > 1:
+            raw = raw.drop(raw.index[row])
+        else:
+            column = columns[int(rng.integers(0, len(columns)))]
+            value = raw[column].iat[int(rng.integers(0, len(raw)))]
+            raw.iloc[row, raw.columns.get_loc(column)] = broken[column] if column in broken and rng.random() < 0.2 else value
+    return raw.reset_index(drop=True) if rng.random() < 0.5 else raw
+
+
+def verify(scripts=30, edits=10, seed=0):
+    ''' Random edit scripts on the real CSV, each refreshed incrementally and rebuilt from scratch: the frames and the
+    rejects must be the same, the changelog must list every species that changed, and the cached results kept for
+    the new version must equal the ones computed again '''
+    import tempfile
+
+    import cube
+
+    rng = np.random.default_rng(seed)
+    raw = dataset.read_source()
+    kept = scoped = 0
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {name: os.path.join(directory, name) for name in ("source.csv", "inc.arrow", "inc.hashes", "inc_rejects.csv", "full.arrow", "full.hashes", "full_rejects.csv", "changelog.csv")}
+        raw.to_csv(paths["source.csv"])
+        previous = dataset.build_artifact(paths["source.csv"], paths["inc.arrow"], None, paths["inc_rejects.csv"], paths["inc.hashes"])
+        previous.attrs["version"] = dataset.source_hash(paths["source.csv"])
+        for script in range(scripts):
+            raw = edit(raw, rng, int(rng.integers(0, edits + 1)))
+            raw.to_csv(paths["source.csv"])
+            version = dataset.source_hash(paths["source.csv"])
+            for group in previous["major_group"].cat.categories:
+                aggregates.group_locations(previous, group)
+            for period in (None,) + cube.PERIODS:
+                aggregates.locations(previous, period)
+
+            dino, changelog, changed = refresh(paths["source.csv"], paths["inc.arrow"], version, paths["inc.hashes"], paths["inc_rejects.csv"], paths["changelog.csv"])
+            full = dataset.build_artifact(paths["source.csv"], paths["full.arrow"], version, paths["full_rejects.csv"], paths["full.hashes"])
+            assert changelog is not None, "fell back to a full rebuild"
+            pd.testing.assert_frame_equal(dino, full)
+            pd.testing.assert_frame_equal(pd.read_csv(paths["inc_rejects.csv"], index_col=0), pd.read_csv(paths["full_rejects.csv"], index_col=0))
+
+            before = previous.set_index(previous[dataset.KEY].to_numpy(dtype=object))[dataset.COLUMNS].astype(object)
+            after = full.set_index(full[dataset.KEY].to_numpy(dtype=object))[dataset.COLUMNS].astype(object)
+            both = after.index[after.index.isin(before.index)]
+            differs = (before.loc[both].ne(after.loc[both]) & ~(before.loc[both].isna() & after.loc[both].isna())).any(axis=1)
+            logged = changelog.groupby("change")["key"].agg(set)
+            assert logged.get("inserted", set()) == set(after.index.difference(before.index)), "inserted"
+            assert logged.get("updated", set()) == set(both[differs]), "updated"
+            assert logged.get("deleted", set()) | (logged.get("rejected", set()) & set(before.index)) == set(before.index.difference(after.index)), "deleted"
+
+            dino.attrs["version"] = version
+            aggregates.refreshed(previous.attrs["version"], version, changed)
+            for key, result in list(aggregates.store.items()):
+                expected = getattr(aggregates, key[0]).__wrapped__(dino, *key[3:])
+                pd.testing.assert_frame_equal(result, expected)
+            kept += len(aggregates.store)
+            scoped += len(previous["major_group"].cat.categories) + 1 + len(cube.PERIODS)
+            aggregates.invalidate()
+            previous = dino
+    print(f"{scripts} edit scripts: incremental refresh == full rebuild, {kept} of {scoped} scoped results kept and still correct")
+
+
+def benchmark(rows=1_000_000, changes=(10, 1000, 10_000), seed=0):
+    ''' Incremental refresh vs. full rebuild of a synthetic source CSV after updating the length and country of
+    some of its rows '''
+    import tempfile
+
+    import synthetic
+
+    rng = np.random.default_rng(seed)
+    raw = synthetic.generate(rows, seed)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, name) for name in ("source.csv", "dino.arrow", "hashes.arrow", "rejects.csv", "changelog.csv", "full.arrow")]
+        source, artifact, hashes, rejects_csv, changelog_csv, full = paths
+        raw.to_csv(source)
+        dataset.build_artifact(source, artifact, None, rejects_csv, hashes)
+        for count in changes:
+            picked = rng.choice(len(raw), count, replace=False)
+            for column in ("length", "lived_in"):
+                raw.iloc[picked, raw.columns.get_loc(column)] = raw[column].iloc[rng.permutation(picked)].to_numpy()
+            raw.to_csv(source)
+            start = time.perf_counter()
+            changelog = refresh(source, artifact, None, hashes, rejects_csv, changelog_csv)[1]
+            incremental = time.perf_counter() - start
+            start = time.perf_counter()
+            dataset.build_artifact(source, full, None, rejects_csv + ".full", hashes + ".full")
+            rebuild = time.perf_counter() - start
+            start = time.perf_counter()
+            dataset.read_source(source)
+            parse = time.perf_counter() - start
+            print(f"{rows:>9} rows, {count:>6} changed  refresh {incremental:6.2f}s  full rebuild {rebuild:6.2f}s  (CSV parse {parse:.2f}s)  {len(changelog)} changelog entries")
+
+
+if __name__ == "__main__":
+    verify()
+    benchmark()
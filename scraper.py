@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+####################################################################################################
+#############################    CONCURRENT, RESUMABLE PAGE SCRAPER    #############################
+####################################################################################################
+''' Fetches the NHM dino-directory pages and pulls the reconstruction image link out of each one.
+Pages are fetched by a thread pool over one pooled session, every host is rate limited, failed
+requests are retried with backoff and each result is written to a checkpoint file together with
+the ETag / Last-Modified headers, so an interrupted run picks up where it stopped and a refresh
+only downloads the pages that changed on the server.'''
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostRateLimiter:
+    ''' Allows at most `rate` requests per second to each host, shared by all worker threads '''
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Checkpoint:
+    ''' JSON file of {url: {"image", "etag", "last_modified", "checked"}} saved atomically '''
+
+    def __init__(self, path, save_every=25):
+        self.path = path
+        self.save_every = save_every
+        self.entries = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, url):
+        return self.entries.get(url)
+
+    def put(self, url, entry):
+        with self.lock:
+            self.entries[url] = entry
+            self.pending += 1
+            if self.pending >= self.save_every:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        self.pending = 0
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+
+def make_session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def parse_image(html):
+    image = BeautifulSoup(html, "html.parser").find("img", {"class": "dinosaur--image"})
+    return image["src"] if image is not None else None
+
+
+def request(session, limiter, url, headers=None, timeout=10, retries=3, backoff=0.5):
+    ''' Rate limited GET, retried with exponential backoff on connection errors and 429 / 5xx responses '''
+    for attempt in range(retries + 1):
+        limiter.wait(url)
+        try:
+            response = session.get(url, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+        time.sleep(backoff * 2 ** attempt)
+
+
+def fetch(session, limiter, url, previous=None, timeout=10, retries=3):
+    ''' Conditional GET of a dino-directory page. Returns the new checkpoint entry for the url '''
+    headers = {}
+    if previous:
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    response = request(session, limiter, url, headers, timeout, retries)
+    if response.status_code == 304:
+        return dict(previous, checked=time.time(), changed=False)
+    response.raise_for_status()
+    return {
+        "image": parse_image(response.text),
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "checked": time.time(),
+        "changed": True,
+    }
+
+
+def scrape_images(links, checkpoint_path=None, workers=8, rate=10, max_age=None, timeout=10, retries=3, failures=None):
+    ''' Returns {link: image url or None} for every link.
+    Links already in the checkpoint are skipped unless they are older than `max_age` seconds, in which case
+    they are revalidated with a conditional request (max_age=0 revalidates everything, None never does).
+    Pages that still fail after the retries are appended to `failures` as (link, error); their image is the
+    checkpointed one, or None if they were never fetched. '''
+    checkpoint = Checkpoint(checkpoint_path)
+    limiter = HostRateLimiter(rate)
+    now = time.time()
+
+    def is_fresh(entry):
+        return entry is not None and (max_age is None or now - entry["checked"] < max_age)
+
+    todo = [link for link in dict.fromkeys(links) if not is_fresh(checkpoint.get(link))]
+    session = make_session(workers)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(fetch, session, limiter, link, checkpoint.get(link), timeout, retries): link for link in todo}
+            for future in as_completed(futures):
+                try:
+                    checkpoint.put(futures[future], future.result())
+                except requests.RequestException as error:  # Not checkpointed, so the next run will try this page again
+                    if failures is not None:
+                        failures.append((futures[future], str(error)))
+    finally:
+        checkpoint.save()
+        session.close()
+    return {link: (checkpoint.get(link) or {}).get("image") for link in links}
+
+
+####################################################################################################
+###################################    OFFLINE STUB & BENCHMARK    #################################
+####################################################################################################
+
+
+def serve_directory(directory):
+    ''' Starts a local HTTP server on a free port serving `directory` (with ETag and Last-Modified headers).
+    Returns (server, base_url); call server.shutdown() when done. '''
+    import functools
+    import hashlib
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(SimpleHTTPRequestHandler):
+        def send_head(self):
+            path = self.translate_path(self.path)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    etag = '"' + hashlib.md5(f.read()).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return None
+                self.etag = etag
+            return super().send_head()
+
+        def end_headers(self):
+            if getattr(self, "etag", None):
+                self.send_header("ETag", self.etag)
+                self.etag = None
+            super().end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(Handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def benchmark(pages=300, workers=8):
+    ''' Scrapes saved NHM-like pages from a local stub server and prints pages/second, cold and on refresh, then checks
+    that a missing page is reported '''
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(pages):
+            with open(os.path.join(tmp, f"dino{i}.html"), "w", encoding="utf-8") as f:
+                f.write(f'<html><body><img class="dinosaur--image" src="https://example.org/dino{i}.jpg"></body></html>')
+        server, base = serve_directory(tmp)
+        links = [f"{base}/dino{i}.html" for i in range(pages)]
+        checkpoint = os.path.join(tmp, "checkpoint.json")
+        try:
+            for label, max_age in (("cold", None), ("refresh", 0)):
+                start = time.perf_counter()
+                images = scrape_images(links, checkpoint, workers=workers, rate=None, max_age=max_age)
+                elapsed = time.perf_counter() - start
+                assert images[links[-1]] == f"https://example.org/dino{pages - 1}.jpg"
+                print(f"{label:8} {pages} pages in {elapsed:.2f}s ({pages / elapsed:.0f} pages/s)")
+            failures, missing = [], f"{base}/missing.html"
+            images = scrape_images(links[:3] + [missing], checkpoint, workers=workers, rate=None, retries=0, failures=failures)
+            assert [link for link, _ in failures] == [missing] and images[missing] is None
+            print(f"failed page reported: {failures[0][1]}")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    benchmark()
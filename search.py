@@ -0,0 +1,298 @@
+import math
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+
+####################################################################################################
+###################################    FUZZY SPECIES SEARCH    #####################################
+####################################################################################################
+''' The sidebar selectbox sent every name to every session and could only filter them in the browser. The search
+index finds species by name, species, any clade of their taxonomy or their discoverer, with typos, on the server.
+Each field is split into lowercase words (terms), and a trigram inverted index over the distinct terms ("$tyr",
+"yra", ..., "us$") finds the terms similar to each word of the query:
+- Dice similarity of the trigram sets, 2 * shared / (query trigrams + term trigrams), tolerates a typo or two;
+- prefix containment (the share of the query trigrams, except the closing one, found in the term) matches words
+  still being typed, scaled by PREFIX_WEIGHT so a complete word ranks first.
+Terms scoring THRESHOLD or more count. A term sharing that many trigrams must contain one of the query's rarest
+trigrams (prefix filtering), so candidates come from the shortest posting lists and only they are scored. A row scores
+the best term match of each query word times the weight of the field, summed over the words. The MAX_RESULTS best
+rows are kept per query (in the aggregates store), so every page of results is a slice.
+Terms, distinct field values and rows are linked by CSR arrays (starts / ends into one sorted array), which keeps the
+index to a few numpy arrays even for millions of rows. It is built once per dataset version, on the first search.'''
+
+FIELDS = {"name": 4.0, "species": 2.0, "taxonomy": 1.0, "named_by": 1.0}  # Weight of a match in each field
+THRESHOLD = 0.6
+PREFIX_WEIGHT = 0.9
+MIN_WORD = 2  # Shorter words of the query are ignored
+MAX_WORD = 40  # Longer terms are cut, their trigrams are packed in fixed-width arrays
+WORD = r"[a-z]+|[0-9]+"  # "Clade12" is two words
+PAGE_SIZE = 20
+MAX_RESULTS = 1000
+VALUE_MASK = 0xFFFFFFFF  # Low half of a term key
+
+
+def normalize(text):
+    ''' Lowercase ASCII words of a Series of strings, accents removed ("Apesteguía" -> ["apesteguia"]) '''
+    text = text.astype(str).str.lower()
+    if not text.map(str.isascii).all():
+        text = text.str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+    return text.str.findall(WORD)
+
+
+def words(text):
+    ''' normalize() of a single string, without the pandas overhead '''
+    return re.findall(WORD, unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii"))
+
+
+def trigrams(term):
+    padded = f"${term[:MAX_WORD]}$".encode("ascii")
+    return {padded[i] << 16 | padded[i + 1] << 8 | padded[i + 2] for i in range(len(padded) - 2)}
+
+
+def csr(keys, count):
+    ''' (starts, ends) of every key 0..count-1 in an array sorted by key '''
+    ends = np.cumsum(np.bincount(keys, minlength=count))
+    return ends - np.bincount(keys, minlength=count), ends
+
+
+def gather(starts, ends, ids):
+    ''' Positions of the items of every id (in `ids` order) and the index in `ids` each one comes from '''
+    lengths = ends[ids] - starts[ids]
+    owners = np.repeat(np.arange(len(ids)), lengths)
+    return np.repeat(starts[ids] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum()), owners
+
+
+def contains(posting, candidates):
+    ''' Which candidates are in the sorted posting list '''
+    if not len(posting):
+        return np.zeros(len(candidates), dtype=bool)
+    return posting[np.searchsorted(posting, candidates).clip(max=len(posting) - 1)] == candidates
+
+
+def best_per(keys, scores):
+    ''' Distinct keys and the highest score of each '''
+    order = np.lexsort((-scores, keys))
+    keys, scores = keys[order], scores[order]
+    first = np.r_[True, keys[1:] != keys[:-1]] if len(keys) else np.empty(0, dtype=bool)
+    return keys[first], scores[first]
+
+
+class SearchIndex:
+    def __init__(self, dino):
+        ''' Values: the distinct values of every field, numbered field after field '''
+        values, pairs, self.row_values = [], [], []
+        for field in FIELDS:
+            codes, uniques = pd.factorize(dino[field])
+            rows = np.flatnonzero(codes >= 0)
+            offset = sum(map(len, values))
+            pairs.append((codes[rows] + offset, rows))
+            self.row_values.append(np.where(codes >= 0, codes + offset, -1))  # The value of every row in this field
+            values.append(pd.Series(uniques, dtype=object))
+        self.field_offsets = np.cumsum([0] + [len(field_values) for field_values in values])
+        self.field_weights = np.array(list(FIELDS.values()))
+        value_keys = np.concatenate([keys for keys, _ in pairs])
+        order = np.argsort(value_keys, kind="stable")
+        self.value_rows = np.concatenate([rows for _, rows in pairs])[order]
+        self.value_starts, self.value_ends = csr(value_keys, self.field_offsets[-1])
+
+        ''' Terms: the distinct words of all values. term_keys (term << 32 | value, sorted) lists the values of every term
+        field after field, value_terms the terms of every value, term_rows how many rows have each term. '''
+        words = normalize(pd.concat(values, ignore_index=True)).explode().dropna()
+        term_codes, self.terms = pd.factorize(words)
+        self.term_keys = np.unique(term_codes.astype(np.int64) << 32 | words.index.to_numpy())  # A word repeated in a value once
+        term_values = self.term_keys & VALUE_MASK
+        order = np.argsort(term_values, kind="stable")
+        self.value_terms = (self.term_keys >> 32)[order]
+        self.value_term_starts, self.value_term_ends = csr(term_values, self.field_offsets[-1])
+        self.term_rows = np.bincount(self.term_keys >> 32, weights=(self.value_ends - self.value_starts)[term_values], minlength=len(self.terms))
+
+        ''' Trigrams of all terms at once: the terms padded as "$term$" into a fixed-width byte matrix '''
+        padded = np.char.add(np.char.add("$", np.asarray(self.terms, dtype=str)).astype(f"S{MAX_WORD + 1}"), b"$")
+        lengths = np.char.str_len(padded)
+        matrix = np.frombuffer(padded.tobytes(), dtype=np.uint8).reshape(len(padded), -1).astype(np.int64)
+        grams = matrix[:, :-2] << 16 | matrix[:, 1:-1] << 8 | matrix[:, 2:]
+        valid = np.arange(grams.shape[1]) < (lengths - 2)[:, None]
+        postings = np.unique(grams[valid] << 32 | np.nonzero(valid)[0])  # Sorted by trigram, then term
+        self.gram_terms = postings & 0xFFFFFFFF
+        self.grams, self.gram_starts = np.unique(postings >> 32, return_index=True)
+        self.gram_ends = np.r_[self.gram_starts[1:], len(postings)]
+        self.term_grams = np.bincount(self.gram_terms, minlength=len(self.terms))
+
+        first_names = pd.factorize(dino["name"])[0]
+        self.browse = np.unique(first_names[first_names >= 0], return_index=True)[1]  # First row of every name, in order
+
+    def posting(self, gram):
+        i = np.searchsorted(self.grams, gram)
+        if i < len(self.grams) and self.grams[i] == gram:
+            return self.gram_terms[self.gram_starts[i]:self.gram_ends[i]]
+        return self.gram_terms[:0]
+
+    def similar_terms(self, word):
+        ''' (term ids, scores) of the terms similar to `word` '''
+        word = word[:MAX_WORD]
+        closing = f"{word[-2:]}$".encode("ascii")
+        closing = closing[0] << 16 | closing[1] << 8 | closing[2]
+        grams = sorted(trigrams(word), key=lambda gram: gram == closing)  # The closing trigram last
+        postings = [self.posting(gram) for gram in grams]
+        q, opening = len(grams), len(grams) - 1
+        dice_pick = q - math.ceil(THRESHOLD * q / (2 - THRESHOLD)) + 1
+        prefix_pick = opening - math.ceil(THRESHOLD / PREFIX_WEIGHT * opening) + 1
+        rarest = sorted(range(q), key=lambda i: len(postings[i]))[:dice_pick]
+        rarest += sorted(range(opening), key=lambda i: len(postings[i]))[:prefix_pick]
+        candidates = np.unique(np.concatenate([postings[i] for i in set(rarest)]))
+
+        shared = np.zeros(len(candidates))
+        for posting in postings[:opening]:
+            shared += contains(posting, candidates)
+        prefix = PREFIX_WEIGHT * shared / opening
+        shared += contains(postings[-1], candidates)
+        scores = np.maximum(2 * shared / (q + self.term_grams[candidates]), prefix)
+        keep = scores >= THRESHOLD
+        return candidates[keep], scores[keep]
+
+    def segments(self, terms, term_scores):
+        ''' (starts, ends, scores) of the values of each (term, field) in term_keys, best score first '''
+        bounds = np.searchsorted(self.term_keys, terms[:, None] << 32 | self.field_offsets)
+        starts, ends = bounds[:, :-1].ravel(), bounds[:, 1:].ravel()
+        scores = (term_scores[:, None] * self.field_weights).ravel()
+        keep = np.flatnonzero(ends > starts)
+        order = keep[np.lexsort((starts[keep], -scores[keep]))]
+        return starts[order], ends[order], scores[order]
+
+    def best_rows(self, starts, ends, scores):
+        ''' The first MAX_RESULTS distinct rows of the segments in order, reading only as many values as needed.
+        A value found through two terms, or a row found in two fields, keeps its first (best) score. '''
+        lengths = np.cumsum(ends - starts)
+        needed = MAX_RESULTS
+        while True:
+            positions, _ = gather(starts, ends, np.arange(min(int(np.searchsorted(lengths, needed)) + 1, len(starts))))
+            values = self.term_keys[positions[:needed]] & VALUE_MASK
+            values = values[np.sort(np.unique(values, return_index=True)[1])]
+            counts = np.cumsum(self.value_ends[values] - self.value_starts[values])
+            positions, _ = gather(self.value_starts, self.value_ends, values[:int(np.searchsorted(counts, needed)) + 1])
+            rows = self.value_rows[positions[:needed]]
+            rows = rows[np.sort(np.unique(rows, return_index=True)[1])]
+            if len(rows) >= MAX_RESULTS or needed >= max(lengths[-1:].sum(), counts[-1:].sum()):
+                return rows[:MAX_RESULTS]
+            needed *= 2
+
+    def scores_of(self, rows, terms, term_scores):
+        ''' Best score of the terms in any field of each row (0 where none of them is found). Field by field, through
+        the values of the terms in it when they are fewer than the rows, through the terms of every row's value otherwise. '''
+        bounds = np.searchsorted(self.term_keys, terms[:, None] << 32 | self.field_offsets)
+        best = np.zeros(len(rows))
+        for field, (field_values, weight) in enumerate(zip(self.row_values, self.field_weights)):
+            starts, ends = bounds[:, field], bounds[:, field + 1]
+            count = (ends - starts).sum()
+            if count == 0:
+                continue
+            row_values = field_values[rows]
+            if count <= len(rows):
+                positions, owners = gather(starts, ends, np.arange(len(terms)))
+                value_scores = np.zeros(self.field_offsets[-1] + 1)  # The extra last one scores rows without a value (-1)
+                np.maximum.at(value_scores, self.term_keys[positions] & VALUE_MASK, term_scores[owners] * weight)
+                best = np.maximum(best, value_scores[row_values])
+                continue
+            term_weights = np.zeros(len(self.terms))
+            term_weights[terms] = term_scores * weight
+            has_value = np.flatnonzero(row_values >= 0)
+            positions, owners = gather(self.value_term_starts, self.value_term_ends, row_values[has_value])
+            np.maximum.at(best, has_value[owners], term_weights[self.value_terms[positions]])
+        return best
+
+    def search(self, query):
+        ''' Row positions of the best MAX_RESULTS rows matching every word of the query, best first '''
+        query = [word for word in words(query) if len(word) >= MIN_WORD]
+        if not query:
+            return self.browse[:MAX_RESULTS]
+        matches = [self.similar_terms(word) for word in query]
+        if len(matches) == 1:
+            return self.best_rows(*self.segments(*matches[0]))
+
+        ''' Several words: all rows of the rarest word, scored by the others '''
+        rarest = int(np.argmin([self.term_rows[terms].sum() for terms, _ in matches]))
+        starts, ends, scores = self.segments(*matches.pop(rarest))
+        positions, owners = gather(starts, ends, np.arange(len(starts)))
+        values, value_scores = best_per(self.term_keys[positions] & VALUE_MASK, scores[owners])
+        positions, owners = gather(self.value_starts, self.value_ends, values)
+        rows, total = best_per(self.value_rows[positions], value_scores[owners])
+        for terms, term_scores in matches:
+            best = self.scores_of(rows, terms, term_scores)
+            rows, total = rows[best > 0], total[best > 0] + best[best > 0]
+        return rows[np.lexsort((rows, -total))[:MAX_RESULTS]]
+
+
+@aggregates.cached
+def search_index(dino):
+    return SearchIndex(dino)
+
+
+@aggregates.cached
+def results(dino, query):
+    return search_index(dino).search(query)
+
+
+def page(dino, query, number, page_size=PAGE_SIZE):
+    ''' Row positions of page `number` (from 0) of the results, and the number of pages '''
+    rows = results(dino, " ".join(words(query)))
+    return rows[number * page_size:(number + 1) * page_size], max(math.ceil(len(rows) / page_size), 1)
+
+
+def typo(word, rng):
+    ''' `word` with one character deleted, doubled, replaced or swapped with the next '''
+    i = int(rng.integers(0, len(word) - 1))
+    kind = rng.integers(0, 4)
+    if kind == 0:
+        return word[:i] + word[i + 1:]
+    if kind == 1:
+        return word[:i] + word[i] + word[i:]
+    if kind == 2:
+        return word[:i] + "aeiou"[int(rng.integers(0, 5))] + word[i + 1:]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def benchmark(sizes=(300, 1_000_000), count=200, seed=0):
+    ''' Index build, then uncached lookups of typos of real names, species and discoverers, clades and prefixes.
+    On the real dataset the misspelled name must come first. '''
+    import time
+
+    import dataset
+    import synthetic
+
+    real = dataset.get()
+    rng = np.random.default_rng(seed)
+    picks = real.sample(count, replace=True, random_state=seed)
+    kinds = {
+        "name typo": [typo(name, rng) for name in picks["name"]],
+        "species typo": [typo(species, rng) for species in picks["species"].dropna()],
+        "discoverer": [named_by.split()[0] for named_by in picks["named_by"]],
+        "clade": [taxonomy.split()[int(rng.integers(1, len(taxonomy.split())))] for taxonomy in picks["taxonomy"]],
+        "prefix": [name[:4] for name in picks["name"]],
+        "two words": [f"{typo(name, rng)} {named_by.split()[0]}" for name, named_by in zip(picks["name"], picks["named_by"])],
+    }
+    for size in sizes:
+        dino = real if size == 300 else dataset.clean(synthetic.generate(size))
+        start = time.perf_counter()
+        index = SearchIndex(dino)
+        print(f"{size:>9} rows  build {time.perf_counter() - start:6.2f}s  {len(index.terms)} terms  {len(index.grams)} trigrams")
+        if size == 300:
+            found = [index.search(query)[:3] for query in kinds["name typo"]]
+            first = np.mean([len(rows) > 0 and dino["name"].iat[rows[0]] == name for rows, name in zip(found, picks["name"])])
+            top3 = np.mean([name in set(dino["name"].iloc[rows]) for rows, name in zip(found, picks["name"])])
+            print(f"          misspelled name ranked first {first:.1%}, in the top 3 {top3:.1%}")
+        for kind, queries in kinds.items():
+            times = []
+            for query in queries:
+                start = time.perf_counter()
+                index.search(query)
+                times.append(time.perf_counter() - start)
+            times = np.array(times) * 1000
+            print(f"          {kind:13} p50 {np.percentile(times, 50):6.3f}ms  p95 {np.percentile(times, 95):7.3f}ms  max {times.max():7.3f}ms")
+
+
+if __name__ == "__main__":
+    benchmark()
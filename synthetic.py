@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+import dataset
+
+####################################################################################################
+###############################    SYNTHETIC OCCURRENCE-STYLE CSV    ###############################
+####################################################################################################
+''' Large inputs for the pipeline and the benchmarks, in the raw format of dino_updated.csv. Rows are resampled from
+the real CSV and then varied: unique names, jittered lengths, shifted period ranges (of the real length), other
+discovery years and deeper taxonomy ranks, with a small share of the problems the cleaning has to handle (missing
+species and countries, names without a year, malformed periods) on top of the real ones. formats() summarizes the
+formats of a raw table, so a synthetic one can be checked against dino_updated.csv. Rows are made CHUNK_ROWS at a time from a seed per chunk,
+so writing any number of rows takes bounded memory and the same seed always gives the same file.'''
+
+CHUNK_ROWS = 100_000
+MISSING = {"species": 0.02, "lived_in": 0.005}  # Extra share of rows with an empty value (real lengths are missing in 5.5%)
+NO_YEAR = 0.01  # Share of named_by without a year, dropped by clean()
+MALFORMED_PERIOD = 0.005  # Share of unreadable periods, moved to the rejects
+
+
+def real_rows():
+    source = dataset.read_source()
+    periods = dataset.parse_periods(source["period"])
+    return source.assign(epoch=periods["period"], period_from=periods["period_from"], period_to=periods["period_to"]).dropna(subset=["period_from"])
+
+
+def generate(rows, seed=0, start=0, source=None):
+    ''' `rows` raw rows, numbered from `start` (the CSV index) '''
+    source = real_rows() if source is None else source
+    rng = np.random.default_rng([seed, start])
+    picked = source.iloc[rng.integers(0, len(source), rows)].reset_index(drop=True)
+    ids = np.arange(start, start + rows)
+
+    fossils = pd.Series(picked["period_from"].to_numpy(dtype=int) + rng.integers(-3, 4, rows))
+    single = ~picked["period"].str.contains(r"\d+\s*-\s*\d+")  # period_to of these is made up by parse_periods()
+    ends = fossils - (picked["period_from"] - picked["period_to"]).to_numpy(dtype=int)
+    period = picked["epoch"].astype(str) + " " + fossils.astype(str) + ("-" + ends.astype(str)).mask(single, "") + " million years ago"
+    period[rng.random(rows) < MALFORMED_PERIOD] = "Unknown"
+
+    authors = picked["named_by"].str.replace(r"\(?\d{4}\)?", "", regex=True).str.strip()
+    years = pd.Series(rng.integers(1820, 2024, rows)).astype(str)
+    named_by = authors + (" (" + years + ")").mask(rng.random(rows) < NO_YEAR, "")
+
+    deeper = rng.random(rows) < 0.2
+    taxonomy = picked["taxonomy"].mask(deeper, picked["taxonomy"] + " Clade" + pd.Series(rng.integers(0, 1000, rows)).astype(str))
+
+    name = picked["name"] + pd.Series(ids).astype(str)
+    raw = pd.DataFrame({
+        "name": name,
+        "diet": picked["diet"],
+        "period": period,
+        "lived_in": picked["lived_in"],
+        "type": picked["type"],
+        "length": (picked["length"].str.rstrip("m").astype(float) * rng.lognormal(0, 0.15, rows)).round(1).astype(str).mask(picked["length"].isna()) + "m",
+        "taxonomy": taxonomy,
+        "named_by": named_by,
+        "species": picked["species"],
+        "link": "https://www.nhm.ac.uk/discover/dino-directory/" + name + ".html",
+        "image": "https://www.nhm.ac.uk/resources/nature-online/life/dinosaurs/dinosaur-directory/images/reconstruction/small/" + name + ".jpg",
+    })
+    raw.index = ids
+    for column, share in MISSING.items():
+        raw.loc[rng.random(rows) < share, column] = np.nan
+    return raw
+
+
+def formats(raw):
+    ''' Shares and averages of the raw formats the cleaning parses, e.g. formats(real_rows()) vs formats(generate(n)) '''
+    period = raw["period"].fillna("")
+    length = pd.to_numeric(raw["length"].str.rstrip("m"), errors="coerce")
+    countries = raw["lived_in"].value_counts(normalize=True)
+    return {
+        "period readable": period.str.match(dataset.PERIOD_PATTERN).mean(),
+        "period range": period.str.contains(r"\d+\s*-\s*\d+").mean(),
+        "period span": (period.str.extract(r"(\d+)\s*-\s*(\d+)").astype(float).diff(axis=1)[1].abs().mean()),
+        "named_by year": raw["named_by"].str.contains(r"\d{4}", na=False).mean(),
+        "length missing": length.isna().mean(),
+        "length median": length.median(),
+        "length p90": length.quantile(0.9),
+        "taxonomy ranks": raw["taxonomy"].str.split().str.len().mean(),
+        "lived_in missing": raw["lived_in"].isna().mean(),
+        "lived_in top share": countries.iloc[0] if len(countries) else 0.0,
+    }
+
+
+def write_csv(path, rows, seed=0, chunk_rows=CHUNK_ROWS):
+    ''' Writes `rows` synthetic rows to `path`, one chunk at a time '''
+    source = real_rows()
+    for start in range(0, rows, chunk_rows):
+        generate(min(chunk_rows, rows - start), seed, start, source).to_csv(path, mode="w" if start == 0 else "a", header=start == 0)
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Write a synthetic dino CSV")
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_csv(args.path, args.rows, args.seed)
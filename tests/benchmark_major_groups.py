@@ -0,0 +1,28 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import dataset
+from tests.test_major_groups import ROOT, contains_loop
+
+''' Times the original str.contains loop and the classifier of dataset.py on a synthetic table of real taxonomies
+with random deeper ranks. python -m tests.benchmark_major_groups from the repository root.'''
+
+
+def benchmark(rows=1_000_000, seed=0):
+    groups = dataset.read_major_groups(os.path.join(ROOT, dataset.MAJOR_GROUPS_CSV))
+    taxonomy = dataset.read_source(os.path.join(ROOT, dataset.SOURCE_CSV))["taxonomy"]
+    rng = np.random.default_rng(seed)
+    synthetic = pd.Series(rng.choice(taxonomy.unique(), rows))
+    deeper = rng.random(rows) < 0.2
+    synthetic[deeper] += " Clade" + pd.Series(rng.integers(0, 100_000, deeper.sum()).astype(str), index=synthetic.index[deeper])
+    for label, classifier in (("str.contains loop", contains_loop), ("token lookup", lambda t: dataset.classify_major_groups(t, groups))):
+        start = time.perf_counter()
+        classifier(synthetic)
+        print(f"{label:18} {rows} rows: {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    benchmark()
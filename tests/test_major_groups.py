@@ -0,0 +1,35 @@
+import os
+
+import pandas as pd
+
+import dataset
+
+####################################################################################################
+#################################    MAJOR GROUP CLASSIFIER    #####################################
+####################################################################################################
+''' The major group list of the original notebook, verbatim and in its order: every group was str.contains-matched
+against the taxonomy and the last matching group in the list won. It is the fixed reference for the classifier in
+dataset.py, major_groups.csv can change without changing it. Run with python -m pytest from the repository root.'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORIGINAL_MAJOR_GROUPS = ["Herrerasauridae", "Guaibasauridae", "Plateosauridae", "Riojasauridae", "Massospondyildae", "Vulcanodontidae", "Turiasauria", "Cetiosauridae",
+                         "Diplodocoidea", "Brachiosauridae", "Titanosauria", "Coelophysoidea", "Ceratosauria", "Megalosauroidea", "Carnosauria", "Megaraptora", "Tyrannosauroidea",
+                         "Compsognathidae", "Ornithomimosauria", "Alvarezsauroidea", "Therizinosauria", "Oviraptorosauria", "Deinonychosauria", "Heterodontosauridae",
+                         "Stegosauria", "Ankylosauria", "Pachycephalosauria", "Ceratopsia", "Ornithopoda", "Anchisauria", "Dromaeosauridae", "Spinosauroidea",
+                         "Alvarezsauridae", "Eusauropoda", "Prosauropoda", "Therizinosauroidea", "Avialae", "Troodontidae"]
+
+
+def contains_loop(taxonomy, groups=ORIGINAL_MAJOR_GROUPS):
+    ''' The original classification, one str.contains scan per group '''
+    major_group = pd.Series("Other", index=taxonomy.index, dtype=object)
+    for m_g in groups:
+        major_group[taxonomy.str.contains(m_g, na=False)] = m_g
+    return major_group
+
+
+def test_major_groups_match_the_original_list():
+    taxonomy = dataset.read_source(os.path.join(ROOT, dataset.SOURCE_CSV))["taxonomy"]
+    expected = contains_loop(taxonomy)
+    found = dataset.classify_major_groups(taxonomy, dataset.read_major_groups(os.path.join(ROOT, dataset.MAJOR_GROUPS_CSV)))
+    changed = expected != found
+    assert not changed.any(), f"major_group assignments changed:\n{pd.DataFrame({'taxonomy': taxonomy, 'original': expected, 'now': found})[changed]}"
@@ -0,0 +1,193 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+import scraper
+
+####################################################################################################
+################################    LOCAL THUMBNAIL PROXY & CACHE    ###############################
+####################################################################################################
+''' With "Include images" on, every viewer used to hotlink the full NHM reconstructions. Each image url is now
+downloaded once (with the scraper's pooled session, rate limit and retries), shrunk with Pillow to the width it is
+shown at and stored in a content-addressed cache: files are named after the SHA-256 of the original image, so urls
+pointing to the same picture share their thumbnails. manifest.json maps urls to those hashes. When the cache grows
+over MAX_CACHE_BYTES the least recently used thumbnails are deleted.
+Images requested while the page renders get one short try (REQUEST_TIMEOUT, no retries), a url that fails is recorded
+in the manifest as {"failed": time} and not requested again for FAILURE_TTL seconds, so a dead link or an unreachable
+host doesn't stall every rerun. prefetch() retries those with the scraper's default timeout and backoff.'''
+
+CACHE_DIR = "./thumbnail_cache"
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+GRID_WIDTH = 150  # "Show species in this group" grid
+SIDEBAR_WIDTH = 300  # Detail card in the sidebar
+WORKERS = 5  # One chunk of the image grid
+GRID_PAGE = 20  # Images per page of the grid, downloaded together: at worst 4 rounds of REQUEST_TIMEOUT
+REQUEST_TIMEOUT = 3  # Seconds, for images downloaded while the page renders
+FAILURE_TTL = 6 * 60 * 60  # Seconds before a failed url is requested again
+
+lock = threading.Lock()
+manifest = None
+session = scraper.make_session(WORKERS)
+limiter = scraper.HostRateLimiter(10)
+
+
+def manifest_path():
+    return os.path.join(CACHE_DIR, "manifest.json")
+
+
+def load_manifest():
+    global manifest
+    if manifest is None:
+        try:
+            with open(manifest_path(), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+    return manifest
+
+
+def save_manifest():
+    tmp = f"{manifest_path()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, manifest_path())
+
+
+def digest_of(entry):
+    ''' The content hash of a manifest entry, None for a failed download '''
+    return entry if isinstance(entry, str) else None
+
+
+def failed_recently(entry):
+    return isinstance(entry, dict) and time.time() - entry["failed"] < FAILURE_TTL
+
+
+def thumbnail_path(digest, width):
+    return os.path.join(CACHE_DIR, f"{digest}-{width}.jpg")
+
+
+def make_thumbnail(original, width):
+    image = Image.open(io.BytesIO(original)).convert("RGB")
+    image.thumbnail((width, width * 10))  # Fixed width, height follows the aspect ratio (never upscaled)
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=85, optimize=True)
+    return out.getvalue()
+
+
+def evict():
+    ''' Deletes least recently used thumbnails until the cache fits in MAX_CACHE_BYTES. Sessions evict under `lock`,
+    files another process removed in the meantime are skipped '''
+    with lock:
+        files = []
+        for entry in os.scandir(CACHE_DIR):
+            if entry.name.endswith(".jpg"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= MAX_CACHE_BYTES:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def fetch(url, widths=(GRID_WIDTH, SIDEBAR_WIDTH), timeout=10, retries=3):
+    ''' Downloads one image and writes a thumbnail for every width. Returns the content hash, or None after recording
+    the failure in the manifest '''
+    try:
+        response = scraper.request(session, limiter, url, timeout=timeout, retries=retries)
+        response.raise_for_status()
+        digest = hashlib.sha256(response.content).hexdigest()
+        for width in widths:
+            if not os.path.exists(thumbnail_path(digest, width)):
+                with open(thumbnail_path(digest, width), "wb") as f:
+                    f.write(make_thumbnail(response.content, width))
+    except (requests.RequestException, OSError):  # Unreachable or not an image (PIL errors are OSErrors)
+        digest = None
+    with lock:
+        load_manifest()[url] = digest or {"failed": time.time()}
+        save_manifest()
+    return digest
+
+
+def thumbnails(urls, width):
+    ''' {url: JPEG bytes or None}; missing urls are downloaded concurrently first, urls that failed within
+    FAILURE_TTL are None without a request '''
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with lock:
+        known = load_manifest()
+        missing = [url for url in dict.fromkeys(urls) if not failed_recently(known.get(url)) and not (digest_of(known.get(url)) and os.path.exists(thumbnail_path(known[url], width)))]
+    if missing:
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            list(pool.map(lambda url: fetch(url, (GRID_WIDTH, SIDEBAR_WIDTH, width), REQUEST_TIMEOUT, 0), missing))
+        evict()
+    images = {}
+    for url in urls:
+        digest = digest_of(manifest.get(url))
+        try:
+            with open(thumbnail_path(digest, width), "rb") as f:
+                images[url] = f.read()
+            os.utime(thumbnail_path(digest, width))  # Mark as recently used for evict()
+        except OSError:  # Failed download (no digest) or evicted in the meantime
+            images.setdefault(url, None)
+    return images
+
+
+def thumbnail(url, width):
+    return thumbnails([url], width)[url]
+
+
+def prefetch(urls):
+    ''' Fills the cache for all urls (e.g. dino["image"]) ahead of time, retrying the ones that failed before '''
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        hashes = list(pool.map(fetch, [url for url in dict.fromkeys(urls) if not digest_of(load_manifest().get(url))]))
+    evict()
+    return sum(digest is not None for digest in hashes)
+
+
+def benchmark(images=100):
+    ''' Offline run against the scraper's stub server: prefetch, then serve the grid from the cache, then dead links twice
+    (the rerun is answered from the failures in the manifest) '''
+    import tempfile
+    global CACHE_DIR, manifest, limiter
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "images"))
+        for i in range(images):
+            Image.new("RGB", (800, 600), (i, 100, 200)).save(os.path.join(tmp, "images", f"dino{i}.jpg"))
+        server, base = scraper.serve_directory(os.path.join(tmp, "images"))
+        CACHE_DIR, manifest, limiter = os.path.join(tmp, "cache"), None, scraper.HostRateLimiter(None)  # Measure the pipeline, not the NHM rate limit
+        urls = [f"{base}/dino{i}.jpg" for i in range(images)]
+        try:
+            start = time.perf_counter()
+            fetched = prefetch(urls)
+            print(f"prefetch {fetched}/{images} images: {time.perf_counter() - start:.2f}s")
+            start = time.perf_counter()
+            grid = thumbnails(urls, GRID_WIDTH)
+            print(f"serve {images} grid thumbnails from cache: {(time.perf_counter() - start) * 1000:.1f}ms, "
+                  f"{sum(map(len, grid.values())) / images / 1024:.1f}KB each (originals {os.path.getsize(os.path.join(tmp, 'images', 'dino0.jpg')) / 1024:.1f}KB)")
+            dead = [f"{base}/missing{i}.jpg" for i in range(WORKERS)] + [f"http://127.0.0.1:9/dino{i}.jpg" for i in range(WORKERS)]  # 404s and a refused connection
+            for run in ("first", "rerun"):
+                start = time.perf_counter()
+                assert not any(thumbnails(dead, GRID_WIDTH).values())
+                print(f"{run} with {len(dead)} dead links: {(time.perf_counter() - start) * 1000:.1f}ms")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    benchmark()